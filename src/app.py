@@ -4,7 +4,7 @@ from tkinter import filedialog, messagebox
 from scanner import ImageScanner, VideoScanner, LiveScanner
 
 path_weights = "weights/best_1.pt"
-path_df = "D:/Proyectos/Pokemon_TCG_Scanner/datasets/cards_of_pokemon.xlsx"
+path_df = "D:/Proyectos/Pokemon_TCG_Scanner/datasets/catalog"
 hash_size = 16
 size = 640
 confidence = 0.9
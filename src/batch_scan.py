@@ -0,0 +1,157 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2
+
+from catalog import load_catalog
+from detector import Detector
+import utils
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+FIELDS = ['file', 'bbox', 'polygon', 'card_id', 'name', 'set_name', 'local_id', 'distance']
+
+worker = {}
+
+def list_images(source):
+    if os.path.isdir(source):
+        paths = [os.path.join(root, name) for root, _, names in os.walk(source) for name in names]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+def init_worker(path_weights, path_df, size, confidence, iou, hash_size, threads, crops_dir, tiles):
+    # Pool replaces a worker whose initializer raises, forever, so the error is
+    # kept and raised from scan_file instead, which stops the run
+    try:
+        cv2.setNumThreads(threads)
+        if threads:
+            try:
+                import torch
+                torch.set_num_threads(threads)
+            except ImportError:
+                pass
+        worker['detector'] = Detector(path_weights)
+        worker['df'], worker['index'] = load_catalog(path_df)
+        worker['params'] = (size, confidence, iou, hash_size)
+        worker['crops_dir'] = crops_dir
+        worker['tiles'] = tiles
+    except Exception as error:
+        worker['error'] = error
+
+def detection_record(path, det, df):
+    record = {
+        'file': path,
+        'bbox': [int(v) for v in det['bbox']],
+        'polygon': [[round(float(x), 1), round(float(y), 1)] for x, y in det['segmentation']],
+        'card_id': None,
+        'name': None,
+        'set_name': None,
+        'local_id': None,
+        'distance': det.get('match_distance'),
+    }
+    if 'match_id' in det:
+        row = df.iloc[det['match_id']]
+        record['card_id'] = str(row['ID']) if 'ID' in row else det['match_id']
+        record['name'], record['set_name'], record['local_id'] = str(row['Name']), str(row['Set_Name']), str(row['Local_ID'])
+    return record
+
+def scan_file(path):
+    if 'error' in worker:
+        raise worker['error']
+    size, confidence, iou, hash_size = worker['params']
+    df, index = worker['df'], worker['index']
+    img = cv2.imread(path)
+    if img is None:
+        return path, None
+    crops_dir = worker['crops_dir']
+    tile_size, tile_overlap = worker['tiles']
+    detections = utils.identify_cards(img, worker['detector'], size, confidence, iou, hash_size, df, index,
+                                      flipped=len(index) == len(df), crops=crops_dir is not None,
+                                      tile_size=tile_size, tile_overlap=tile_overlap)
+    if crops_dir is not None:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for i, det in enumerate(detections):
+            if 'card_image' in det:
+                cv2.imwrite(os.path.join(crops_dir, f"{stem}_{i}.png"), det['card_image'])
+    return path, [detection_record(path, det, df) for det in detections]
+
+class ResultWriter():
+
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(stream, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def write(self, record):
+        if self.fmt == 'csv':
+            self.writer.writerow({**record, 'bbox': json.dumps(record['bbox']), 'polygon': json.dumps(record['polygon'])})
+        else:
+            self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+def run(paths, args):
+    fmt = args.format or ('csv' if args.output and args.output.lower().endswith('.csv') else 'jsonl')
+    stream = open(args.output, 'w', newline='') if args.output else sys.stdout
+    writer = ResultWriter(stream, fmt)
+
+    n_images = n_failed = n_detections = n_matched = 0
+    start = time.perf_counter()
+    initargs = (args.weights, args.catalog, args.size, args.confidence, args.iou, args.hash_size, args.threads,
+                args.save_crops, (args.tile, args.tile_overlap))
+    with Pool(args.workers, initializer=init_worker, initargs=initargs) as pool:
+        for path, records in pool.imap_unordered(scan_file, paths, chunksize=args.chunksize):
+            n_images += 1
+            if records is None:
+                n_failed += 1
+                print(f"Could not read the image: {path}", file=sys.stderr)
+                continue
+            for record in records:
+                writer.write(record)
+                n_detections += 1
+                n_matched += record['card_id'] is not None
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        stream.close()
+    print(f"Scanned {n_images} images ({n_failed} unreadable) in {elapsed:.1f}s: "
+          f"{n_images / elapsed:.2f} images/s, {n_detections} cards detected, {n_matched} identified",
+          file=sys.stderr)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scan folders of images for Pokemon TCG cards without the GUI.")
+    parser.add_argument('source', help="Directory to walk or glob pattern of images")
+    parser.add_argument('--catalog', required=True, help="Binary catalog folder or cards_of_pokemon.xlsx")
+    parser.add_argument('--weights', default="weights/best_1.pt")
+    parser.add_argument('--output', help="Output file (.jsonl or .csv), defaults to stdout")
+    parser.add_argument('--format', choices=['jsonl', 'csv'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads', type=int, default=1, help="Threads per worker for OpenCV and PyTorch")
+    parser.add_argument('--chunksize', type=int, default=4)
+    parser.add_argument('--size', type=int, default=640, help="Detector input size; cards are cropped at full resolution")
+    parser.add_argument('--confidence', type=float, default=0.9)
+    parser.add_argument('--iou', type=float, default=0.8)
+    parser.add_argument('--hash-size', type=int, default=16)
+    parser.add_argument('--tile', type=int, metavar='SIZE', help="Detect in SIZE x SIZE tiles of the original image")
+    parser.add_argument('--tile-overlap', type=float, default=0.25, help="Tile overlap as a fraction of the tile size")
+    parser.add_argument('--save-crops', metavar='DIR', help="Also write each rectified 600x825 card to DIR")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    paths = list_images(args.source)
+    if not paths:
+        sys.exit(f"No images found in {args.source}")
+    for path in (args.catalog, args.weights):
+        if not os.path.exists(path):
+            sys.exit(f"Not found: {path}")
+    if args.save_crops:
+        os.makedirs(args.save_crops, exist_ok=True)
+    run(paths, args)
@@ -0,0 +1,36 @@
+import argparse
+
+from batch_scan import list_images
+from benchmarking import latency_stats, print_table, time_calls
+from detector import Detector
+import utils
+
+def accuracy(detector, data, split, size):
+    metrics = detector.model.val(data=data, split=split, imgsz=size, batch=1, plots=False)
+    return {'box_map50': float(metrics.box.map50), 'mask_map50': float(metrics.seg.map50), 'mask_map': float(metrics.seg.map)}
+
+def benchmark(weights, images, data, split, size, confidence, iou):
+    rows = []
+    for path in weights:
+        detector = Detector(path)
+        times = time_calls(lambda img: detector.detect_objects(img, confidence, iou, size), images)
+        row = {'weights': path, 'backend': detector.backend, **latency_stats(times), 'fps': float(1e3 / times.mean())}
+        if data:
+            row.update(accuracy(detector, data, split, size))
+        rows.append(row)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare latency and accuracy of the detector backends.")
+    parser.add_argument('weights', nargs='+', help="e.g. weights/best_1.pt weights/best_1.onnx weights/best_1_int8_openvino_model")
+    parser.add_argument('--images', required=True, help="Directory or glob of images used for latency")
+    parser.add_argument('--data', help="data.yaml of the synthetic dataset, for mask and box mAP")
+    parser.add_argument('--split', default='test')
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--size', type=int, default=640)
+    parser.add_argument('--confidence', type=float, default=0.9)
+    parser.add_argument('--iou', type=float, default=0.8)
+    args = parser.parse_args()
+
+    images = [utils.read_image(path) for path in list_images(args.images)[:args.frames]]
+    print_table(benchmark(args.weights, images, args.data, args.split, args.size, args.confidence, args.iou))
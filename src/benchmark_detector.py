@@ -0,0 +1,45 @@
+import argparse
+
+import cv2
+
+from benchmarking import print_table, time_calls
+from detector import Detector
+
+
+def read_frames(path_video, max_frames):
+    video = cv2.VideoCapture(path_video)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = video.read()
+        if not ret:
+            break
+        frames.append(frame)
+    video.release()
+    return frames
+
+def frames_per_second(detector, frames, batch_size, size, confidence, iou):
+    if batch_size == 1:
+        times = time_calls(lambda frame: detector.detect_objects(frame, confidence, iou, size), frames)
+    else:
+        batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+        times = time_calls(lambda batch: detector.detect_batch(batch, confidence, iou, size), batches)
+    return len(frames) / (times.sum() / 1e3)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare one-frame and batched detection throughput.")
+    parser.add_argument('video')
+    parser.add_argument('--weights', default="weights/best_1.pt")
+    parser.add_argument('--size', type=int, default=640, help="Detector input size")
+    parser.add_argument('--frames', type=int, default=64)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--confidence', type=float, default=0.9)
+    parser.add_argument('--iou', type=float, default=0.8)
+    args = parser.parse_args()
+
+    detector = Detector(args.weights)
+    frames = read_frames(args.video, args.frames)
+    rows = [{'batch': batch_size, 'fps': frames_per_second(detector, frames, batch_size, args.size, args.confidence, args.iou)}
+            for batch_size in args.batch_sizes]
+    for row in rows:
+        row['gain'] = row['fps'] / rows[0]['fps']
+    print_table(rows)
@@ -0,0 +1,53 @@
+import time
+import numpy as np
+
+from benchmarking import print_table, time_calls
+import utils
+from hash_index import HashIndex
+
+
+def random_catalog(n, n_bytes, rng):
+    return rng.integers(0, 256, (n, n_bytes), dtype=np.uint8)
+
+def noisy_queries(bits, n_queries, n_flips, rng):
+    ids = rng.choice(len(bits), n_queries, replace=False)
+    queries = np.unpackbits(bits[ids], axis=1)
+    for row in queries:
+        row[rng.choice(queries.shape[1], n_flips, replace=False)] ^= 1
+    return ids, np.packbits(queries, axis=1)
+
+def linear_search(queries, hashes, threshold):
+    distances = utils.hamming_distances(queries, hashes)
+    ids = distances.argmin(axis=1)
+    best = distances[np.arange(len(ids)), ids]
+    return np.where(best < threshold, ids, -1)
+
+def benchmark(sizes, flips, n_queries=64, n_bytes=64, threshold=168, repeat=5, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for size in sizes:
+        bits = random_catalog(size, n_bytes, rng)
+        hashes = utils.pack_hashes(bits)
+        start = time.perf_counter()
+        index = HashIndex(hashes)
+        build = time.perf_counter() - start
+        for n_flips in flips:
+            truth, queries = noisy_queries(bits, n_queries, n_flips, rng)
+            # The first search of each kind doubles as the warm-up
+            linear = linear_search(queries, hashes, threshold)
+            ids, _ = index.search(queries, 1, threshold)
+            t_linear = time_calls(lambda q: linear_search(q, hashes, threshold), [queries], repeat, warmup=False).mean() / 1e3
+            t_index = time_calls(lambda q: index.search(q, 1, threshold), [queries], repeat, warmup=False).mean() / 1e3
+            rows.append({
+                'catalog': size,
+                'flipped_bits': n_flips,
+                'build_s': build,
+                'linear_ms': t_linear / n_queries * 1e3,
+                'index_ms': t_index / n_queries * 1e3,
+                'recall_vs_linear': float(np.mean(ids[:, 0] == linear)),
+                'recall_vs_truth': float(np.mean(ids[:, 0] == truth)),
+            })
+    return rows
+
+if __name__ == "__main__":
+    print_table(benchmark(sizes=[1000, 10000, 50000, 200000], flips=[16, 64, 128]))
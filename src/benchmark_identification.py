@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from benchmarking import latency_stats, print_table, time_calls
+from generate_tcg_dataset import place_cards_on_background
+from hash_index import HashIndex
+import hashing
+from tracker import Tracker
+import utils
+
+# Stand-ins for the ultralytics Results fields that process_detections reads,
+# filled from the ground truth that place_cards_on_background returns
+class StubTensor():
+
+    def __init__(self, array):
+        self.array = np.asarray(array)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+class StubMasks():
+
+    def __init__(self, polygons, shape):
+        self.xy = polygons
+        self.data = []
+        for polygon in polygons:
+            mask = np.zeros(shape[:2], dtype=np.float32)
+            cv2.fillPoly(mask, [polygon.astype(np.int32)], 1.0)
+            self.data.append(StubTensor(mask))
+
+class StubBoxes():
+
+    def __init__(self, polygons):
+        self.xywh = [StubTensor(np.r_[(p.min(axis=0) + p.max(axis=0)) / 2, p.max(axis=0) - p.min(axis=0)]) for p in polygons]
+
+class StubResults():
+
+    def __init__(self, polygons, shape):
+        self.masks = StubMasks(polygons, shape) if polygons else None
+        self.boxes = StubBoxes(polygons)
+
+class StubDetector():
+
+    # Returns the generated annotations of whichever scene it is given
+    def __init__(self, scenes):
+        self.results = {id(img): StubResults(polygons, img.shape) for img, polygons in scenes}
+
+    def detect_objects(self, image, confidence, iou, size=640):
+        return self.results[id(image)]
+
+    def detect_batch(self, images, confidence, iou, size=640):
+        return [self.results[id(img)] for img in images]
+
+def make_assets(folder, n_cards, n_backgrounds, rng, card_size=(240, 330), background_size=(1280, 960)):
+    cards, backgrounds = [], []
+    for i in range(n_cards):
+        card = cv2.resize(rng.integers(0, 256, (11, 8, 3), dtype=np.uint8), card_size, interpolation=cv2.INTER_CUBIC)
+        for _ in range(12):
+            center = (int(rng.integers(0, card_size[0])), int(rng.integers(0, card_size[1])))
+            cv2.circle(card, center, int(rng.integers(4, 40)), [int(v) for v in rng.integers(0, 256, 3)], -1)
+        path = os.path.join(folder, f"card_{i}.png")
+        cv2.imwrite(path, cv2.cvtColor(card, cv2.COLOR_BGR2BGRA))
+        cards.append(path)
+    for i in range(n_backgrounds):
+        background = cv2.GaussianBlur(rng.integers(0, 256, background_size[::-1] + (3,), dtype=np.uint8), (31, 31), 0)
+        path = os.path.join(folder, f"background_{i}.jpg")
+        cv2.imwrite(path, background)
+        backgrounds.append(path)
+    return cards, backgrounds
+
+def make_scenes(n_scenes, cards_per_scene, seed):
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as folder:
+        cards, backgrounds = make_assets(folder, 2 * cards_per_scene, 4, rng)
+        scenes = []
+        for _ in range(n_scenes):
+            img, annotations, _, _, _ = place_cards_on_background(random.choice(backgrounds), random.sample(cards, cards_per_scene))
+            polygons = [np.array(a['segmentation'][0], dtype=np.float32).reshape(-1, 2) for a in annotations]
+            scenes.append((img, polygons))
+        card_images = [cv2.imread(path) for path in cards]
+    return scenes, card_images
+
+def make_catalog(size, card_images, hash_size, rng):
+    # Random hashes with the real card hashes mixed in, so every match has a true target
+    n_bytes = (2 * hash_size * hash_size + 7) // 8
+    bits = rng.integers(0, 256, (size, n_bytes), dtype=np.uint8)
+    positions = rng.choice(size, len(card_images), replace=False)
+    bits[positions] = hashing.hash_images([cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in card_images], hash_size)
+    df = pd.DataFrame({'Name': [f"card {i}" for i in range(size)], 'Set_Name': 'bench', 'Local_ID': np.arange(size).astype(str)})
+    return df, HashIndex(utils.pack_hashes(bits))
+
+def measure(name, fn, inputs, repeat, cards):
+    ms = time_calls(fn, inputs, repeat)
+    return {'benchmark': name, 'calls': len(ms), **latency_stats(ms), 'cards_per_s': float(cards * repeat / (ms.sum() / 1e3))}
+
+def track_sequence(detections, frames, rng):
+    # The same cards drifting a few pixels per frame
+    sequence = []
+    for _ in range(frames):
+        moved = []
+        for det in detections:
+            shift = rng.normal(0, 3, 2)
+            moved.append({**det, 'bbox': (det['bbox'] + np.r_[shift, 0, 0]).astype(int),
+                          'segmentation': det['segmentation'] + shift.astype(np.float32)})
+        sequence.append(moved)
+    return sequence
+
+def run_tracker(sequence):
+    tracker = Tracker()
+    for detections in sequence:
+        detections = [dict(det) for det in detections]
+        assignment = tracker.assign(detections)
+        tracker.reuse_identities(detections, assignment)
+        tracker.update(detections, assignment)
+
+def benchmark(n_scenes=20, cards_per_scene=4, catalogs=(1000, 10000, 50000), hash_size=16, repeat=5, seed=0):
+    rng = np.random.default_rng(seed)
+    scenes, card_images = make_scenes(n_scenes, cards_per_scene, seed)
+    detector = StubDetector(scenes)
+    images = [img for img, _ in scenes]
+    n_cards = sum(len(polygons) for _, polygons in scenes)
+
+    results = [detector.detect_objects(img, 0.9, 0.8) for img in images]
+    rows = [measure('process_detections', utils.process_detections, results, repeat, n_cards)]
+
+    detections = [utils.process_detections(result) for result in results]
+    pairs = list(zip(images, detections))
+    rows.append(measure('mask_to_card', lambda p: utils.mask_to_card(*p), pairs, repeat, n_cards))
+    for img, dets in pairs:
+        utils.mask_to_card(img, dets)
+    rows.append(measure('hash_cards', lambda dets: utils.hash_cards(dets, hash_size), detections, repeat, n_cards))
+
+    for size in catalogs:
+        df, index = make_catalog(size, card_images, hash_size, rng)
+        row = measure(f'match_hashes_{size}', lambda dets: utils.match_hashes(dets, df, index), detections, repeat, n_cards)
+        row['matched'] = float(np.mean([('match_id' in det) for dets in detections for det in dets]))
+        rows.append(row)
+
+    sequences = [track_sequence(dets, 30, rng) for dets in detections]
+    rows.append(measure('track_30_frames', run_tracker, sequences, repeat, n_cards * 30))
+    return rows
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'seed': args.seed, 'scenes': args.scenes,
+            'cards_per_scene': args.cards, 'repeat': args.repeat}
+
+def compare_rows(rows, baseline):
+    # >1 means faster than the baseline run
+    return [{**row, 'vs_baseline': baseline[row['benchmark']]['mean_ms'] / row['mean_ms'] if row['benchmark'] in baseline else '-'}
+            for row in rows]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the identification hot path on deterministic synthetic scenes.")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results from an earlier run to compare against")
+    parser.add_argument('--scenes', type=int, default=20)
+    parser.add_argument('--cards', type=int, default=4, help="Cards per scene")
+    parser.add_argument('--catalogs', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = benchmark(args.scenes, args.cards, args.catalogs, repeat=args.repeat, seed=args.seed)
+    header = ['benchmark', 'calls', 'mean_ms', 'p50_ms', 'p95_ms', 'cards_per_s']
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = {row['benchmark']: row for row in json.load(file)['results']}
+        print_table(compare_rows(rows, baseline), header + ['vs_baseline'])
+    else:
+        print_table(rows, header)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'meta': metadata(args), 'results': rows}, file, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
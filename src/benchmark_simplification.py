@@ -0,0 +1,55 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from shapely.geometry import Polygon
+
+from generate_tcg_dataset import simplify_all_segmentations
+
+def read_polygons(label_dir):
+    polygons = {}
+    for fname in sorted(os.listdir(label_dir)):
+        if fname.endswith('.txt'):
+            with open(os.path.join(label_dir, fname)) as file:
+                polygons[fname] = [np.array(line.split()[1:], dtype=np.float64).reshape(-1, 2) for line in file if line.strip()]
+    return polygons
+
+def simplify_copy(label_dir, folder, tolerance, workers, engine):
+    # Simplification rewrites labels in place, so every run gets its own copy
+    shutil.copytree(label_dir, folder)
+    start = time.perf_counter()
+    simplify_all_segmentations(folder, tolerance, workers, engine)
+    return time.perf_counter() - start, read_polygons(folder)
+
+def iou(a, b):
+    a, b = Polygon(a).buffer(0), Polygon(b).buffer(0)
+    union = a.union(b).area
+    return a.intersection(b).area / union if union else 1.0
+
+def compare(label_dir, tolerance=0.001, workers=os.cpu_count()):
+    original = read_polygons(label_dir)
+    with tempfile.TemporaryDirectory() as folder:
+        runs = [('shapely', 1), ('cv2', 1), ('cv2', workers)]
+        results = {run: simplify_copy(label_dir, os.path.join(folder, f"{run[0]}_{run[1]}"), tolerance, *run[::-1]) for run in runs}
+
+    reference, simplified = results[('shapely', 1)][1], results[('cv2', workers)][1]
+    pairs = [(a, b) for fname in reference for a, b in zip(reference[fname], simplified[fname])]
+    ious = np.array([iou(a, b) for a, b in pairs])
+    print(f"{len(original)} label files, {len(pairs)} polygons, tolerance {tolerance}")
+    print(f"Vertices per polygon: original {np.mean([len(p) for ps in original.values() for p in ps]):.1f}, "
+          f"shapely {np.mean([len(a) for a, _ in pairs]):.1f}, cv2 {np.mean([len(b) for _, b in pairs]):.1f}")
+    print(f"IoU cv2 vs shapely: mean {ious.mean():.4f}, p1 {np.percentile(ious, 1):.4f}, min {ious.min():.4f}")
+    for (engine, n), (elapsed, _) in results.items():
+        print(f"{engine:>8} x{n:<3} {elapsed:8.2f}s  {len(original) / elapsed:10.1f} files/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the cv2 label simplification against the shapely one.")
+    parser.add_argument('labels', help="Folder of unsimplified YOLO segmentation labels, e.g. <dataset>/labels")
+    parser.add_argument('--tolerance', type=float, default=0.001)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    compare(args.labels, args.tolerance, args.workers)
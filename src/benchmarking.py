@@ -0,0 +1,33 @@
+import time
+
+import numpy as np
+
+# Timing loop and table printer shared by the benchmark and evaluation scripts
+
+def time_calls(fn, inputs, repeat=1, warmup=True):
+    # Warm-up so model loading and first-call allocation are not timed
+    if warmup:
+        fn(inputs[0])
+    times = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter_ns()
+            fn(item)
+            times.append(time.perf_counter_ns() - start)
+    return np.array(times) / 1e6
+
+def latency_stats(ms):
+    return {
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+    }
+
+def print_table(rows, header=None):
+    # Columns are right aligned and as wide as their widest cell; floats get 4 decimals
+    header = header or list(rows[0])
+    cells = [[f'{row[h]:.4f}' if isinstance(row[h], float) else f'{row[h]}' for h in header] for row in rows]
+    widths = [max([len(h)] + [len(line[i]) for line in cells]) for i, h in enumerate(header)]
+    print(' | '.join(f'{h:>{w}}' for h, w in zip(header, widths)))
+    for line in cells:
+        print(' | '.join(f'{cell:>{w}}' for cell, w in zip(line, widths)))
@@ -0,0 +1,45 @@
+import os
+import numpy as np
+import pandas as pd
+
+import utils
+from hash_index import HashIndex, build_tables
+
+# Only Name, Set_Name and Local_ID are required; ID and Set_ID are kept when present
+METADATA_COLUMNS = ['ID', 'Name', 'Set_Name', 'Local_ID', 'Set_ID']
+
+def read_excel_catalog(path_df):
+    df = pd.read_excel(path_df).dropna(subset=['hash']).reset_index(drop=True)
+    hashes = utils.hashes_to_matrix(df['hash'])
+    if 'hash_rotated' in df.columns and df['hash_rotated'].notna().all():
+        # Rotated hashes follow the normal ones, so a catalog row is index id % len(df)
+        hashes = utils.pack_hashes(np.concatenate([hashes, utils.hashes_to_matrix(df['hash_rotated'])]))
+    return df, hashes
+
+def export_catalog(path_df, path_catalog):
+    df, hashes = read_excel_catalog(path_df)
+    ids, offsets = build_tables(hashes)
+
+    os.makedirs(path_catalog, exist_ok=True)
+    np.save(os.path.join(path_catalog, 'hashes.npy'), hashes)
+    np.save(os.path.join(path_catalog, 'index_ids.npy'), ids)
+    np.save(os.path.join(path_catalog, 'index_offsets.npy'), offsets)
+    np.savez(os.path.join(path_catalog, 'metadata.npz'),
+             **{column: df[column].astype(str).to_numpy(dtype=str) for column in METADATA_COLUMNS if column in df.columns})
+
+def load_catalog(path):
+    if not os.path.isdir(path):
+        df, hashes = read_excel_catalog(path)
+        return df, HashIndex(hashes)
+
+    # Read-only memory maps let every scanner process share the same pages
+    hashes = np.load(os.path.join(path, 'hashes.npy'), mmap_mode='r')
+    tables = (np.load(os.path.join(path, 'index_ids.npy'), mmap_mode='r'),
+              np.load(os.path.join(path, 'index_offsets.npy'), mmap_mode='r'))
+    with np.load(os.path.join(path, 'metadata.npz')) as metadata:
+        df = pd.DataFrame({column: metadata[column] for column in metadata.files})
+    return df, HashIndex(hashes, tables=tables)
+
+if __name__ == "__main__":
+    export_catalog("D:/Proyectos/Pokemon_TCG_Scanner/datasets/cards_of_pokemon.xlsx",
+                   "D:/Proyectos/Pokemon_TCG_Scanner/datasets/catalog")
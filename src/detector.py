@@ -1,9 +1,76 @@
+import argparse
+import os
+import yaml
 from ultralytics import YOLO
 
+# Every backend goes through ultralytics, so all of them return the same
+# Results objects that utils.process_detections reads. The weights path
+# picks the backend: a .pt file, an .onnx file or an OpenVINO IR folder.
+BACKENDS = {
+    'pytorch': '.pt',
+    'onnx': '.onnx',
+    'openvino': '_openvino_model',
+}
+
+def backend_of(weights):
+    name = os.path.normpath(weights)
+    for backend, suffix in BACKENDS.items():
+        if name.endswith(suffix):
+            return backend
+    raise ValueError(f"Unknown detector weights format: {weights}")
+
+def static_size(weights):
+    # OpenVINO models exported without dynamic shapes (INT8 exports made before
+    # export_weights passed dynamic=True) only take one image at the export size
+    path = os.path.join(weights, 'metadata.yaml')
+    if backend_of(weights) != 'openvino' or not os.path.exists(path):
+        return None
+    with open(path) as file:
+        metadata = yaml.safe_load(file)
+    if metadata.get('args', {}).get('dynamic', True):
+        return None
+    return metadata['imgsz']
+
 class Detector():
 
     def __init__(self, weights):
-        self.model =YOLO(weights)
+        self.backend = backend_of(weights)
+        self.static_size = static_size(weights)
+        # Exported models do not always carry the task, so it is set explicitly
+        self.model = YOLO(weights, task='segment')
+
+    # size is the detector's input size; results stay in the input image's coordinates.
+    # Static models ignore size and run at their export size.
+    def detect_objects(self, path_image, confidence, iou, size=640):
+        return self.model(path_image, conf=confidence, iou=iou, imgsz=self.static_size or size)[0]
+
+    def detect_batch(self, images, confidence, iou, size=640):
+        if self.static_size:
+            return [self.detect_objects(img, confidence, iou, size) for img in images]
+        return self.model(list(images), conf=confidence, iou=iou, imgsz=size)
+
+def export_weights(weights, backend, size=640, int8=False, data=None):
+    # Both formats are exported with dynamic shapes so batches and any detector
+    # size work, INT8 included. INT8 goes through OpenVINO's post-training quantization (NNCF), which
+    # calibrates on the images listed in the dataset's data.yaml.
+    model = YOLO(weights, task='segment')
+    if backend == 'onnx':
+        return model.export(format='onnx', imgsz=size, dynamic=True, simplify=True)
+    if backend == 'openvino':
+        return model.export(format='openvino', imgsz=size, dynamic=True, int8=int8, data=data)
+    raise ValueError(f"Cannot export to {backend}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the card detector to CPU-friendly backends.")
+    parser.add_argument('weights', nargs='?', default="weights/best_1.pt")
+    parser.add_argument('--backends', nargs='+', choices=['onnx', 'openvino'], default=['onnx', 'openvino'])
+    parser.add_argument('--size', type=int, default=640)
+    parser.add_argument('--int8', action='store_true', help="Also export an INT8 OpenVINO model")
+    parser.add_argument('--data', default="D:/Proyectos/Pokemon_TCG_Scanner/datasets/synthetic_dataset/splited_dataset/data.yaml",
+                        help="data.yaml of the synthetic dataset, used to calibrate INT8")
+    args = parser.parse_args()
 
-    def detect_objects(self, path_image, confidence, iou):
-        return self.model(path_image, conf=confidence, iou=iou)[0]
\ No newline at end of file
+    for backend in args.backends:
+        print(f"{backend}: {export_weights(args.weights, backend, args.size)}")
+    if args.int8:
+        print(f"openvino int8: {export_weights(args.weights, 'openvino', args.size, int8=True, data=args.data)}")
@@ -0,0 +1,143 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+
+from benchmarking import print_table
+from detector import Detector
+from hash_index import HashIndex
+import hashing
+from tracker import box_iou
+import utils
+
+def load_scenes(path_dataset, split=None, limit=None):
+    # Annotations live next to the generated images; a split only narrows the image list.
+    # Datasets streamed straight into splits have no top level images folder.
+    folders = [os.path.join(path_dataset, 'splited_dataset', split, 'images') if split else os.path.join(path_dataset, 'images')]
+    if not split and not os.path.isdir(folders[0]):
+        folders = sorted(glob.glob(os.path.join(path_dataset, 'splited_dataset', '*', 'images')))
+    scenes = []
+    for folder, name in sorted(((folder, name) for folder in folders for name in os.listdir(folder)), key=lambda f: f[1])[:limit]:
+        with open(os.path.join(path_dataset, 'annotations', os.path.splitext(name)[0] + '.json')) as file:
+            annotations = json.load(file)['annotations']
+        if any('card_file' not in a for a in annotations):
+            raise ValueError(f"{name} has no card identities, regenerate the dataset with generate_tcg_dataset.py")
+        # Annotation boxes are top-left based, detections are center based
+        boxes = np.array([[x + w / 2, y + h / 2, w, h] for x, y, w, h in (a['bbox'] for a in annotations)]).reshape(-1, 4)
+        scenes.append({'path': os.path.join(folder, name), 'boxes': boxes, 'cards': [a['card_file'] for a in annotations]})
+    return scenes
+
+def build_catalog(path_cards, hash_size):
+    # Hashed the way generate_pokemon_tcg_card_dataset.py does it (RGB, plus the
+    # 180 degree rotation), at whatever hash_size is being evaluated
+    names = sorted(os.listdir(path_cards))
+    images = [cv2.cvtColor(cv2.imread(os.path.join(path_cards, name), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB) for name in names]
+    hashes = hashing.hash_images(images, hash_size)
+    rotated = hashing.hash_images([img[::-1, ::-1] for img in images], hash_size)
+    df = pd.DataFrame({'Name': names, 'Set_Name': '', 'Local_ID': ''})
+    return df, HashIndex(utils.pack_hashes(np.concatenate([hashes, rotated])))
+
+def score(scenes, predictions, df, min_iou=0.5):
+    n_truth = n_found = n_identified = n_correct = 0
+    for scene, detections in zip(scenes, predictions):
+        n_truth += len(scene['cards'])
+        n_identified += sum('match_id' in det for det in detections)
+        if not detections or not scene['cards']:
+            continue
+        iou = box_iou(np.array([det['bbox'] for det in detections])[:, None], scene['boxes'][None])
+        rows, cols = linear_sum_assignment(iou, maximize=True)
+        for i, j in zip(rows, cols):
+            if iou[i, j] >= min_iou:
+                n_found += 1
+                n_correct += 'match_id' in detections[i] and df['Name'][detections[i]['match_id']] == scene['cards'][j]
+    return {
+        'detection_recall': n_found / max(n_truth, 1),
+        'precision': n_correct / max(n_identified, 1),
+        'recall': n_correct / max(n_truth, 1),
+    }
+
+def clear_matches(detections):
+    return [{k: v for k, v in det.items() if k not in ('match_card', 'match_id', 'match_distance')} for det in detections]
+
+def evaluate(scenes, images, path_cards, weights, sizes, confidences, ious, hash_sizes, thresholds):
+    # Each stage runs once per setting it depends on; the reported latency is
+    # the sum of detect, rectify, hash and match for every image
+    catalogs = {hash_size: build_catalog(path_cards, hash_size) for hash_size in hash_sizes}
+    rows = []
+    for path_weights in weights:
+        detector = Detector(path_weights)
+        detector.detect_objects(images[0], confidences[0], ious[0], sizes[0])
+        for size, confidence, iou in itertools.product(sizes, confidences, ious):
+            detected, detect_ms = [], []
+            for img in images:
+                start = time.perf_counter()
+                detections = utils.detect_cards(img, detector, size, confidence, iou)
+                utils.mask_to_card(img, detections)
+                detect_ms.append((time.perf_counter() - start) * 1e3)
+                detected.append(detections)
+
+            for hash_size in hash_sizes:
+                df, index = catalogs[hash_size]
+                hashed, hash_ms = [], []
+                for detections in detected:
+                    detections = [dict(det) for det in detections]
+                    start = time.perf_counter()
+                    # Same query as the scanner: the catalog holds rotated hashes, so one hash per card
+                    utils.hash_cards(detections, hash_size, flipped=len(index) == len(df))
+                    hash_ms.append((time.perf_counter() - start) * 1e3)
+                    hashed.append(detections)
+
+                for threshold in thresholds:
+                    # Thresholds are a fraction of the hash length (dHash + pHash), so one
+                    # value means the same across hash sizes
+                    bits = round(threshold * 2 * hash_size ** 2)
+                    matched, match_ms = [], []
+                    for detections in hashed:
+                        detections = clear_matches(detections)
+                        start = time.perf_counter()
+                        utils.match_hashes(detections, df, index, bits)
+                        match_ms.append((time.perf_counter() - start) * 1e3)
+                        matched.append(detections)
+
+                    latency = np.array(detect_ms) + np.array(hash_ms) + np.array(match_ms)
+                    rows.append({
+                        'weights': path_weights, 'size': size, 'confidence': confidence, 'iou': iou,
+                        'hash_size': hash_size, 'threshold': threshold, 'threshold_bits': bits,
+                        **score(scenes, matched, df),
+                        'p50_ms': float(np.percentile(latency, 50)),
+                        'p95_ms': float(np.percentile(latency, 95)),
+                    })
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure identification accuracy and latency on synthetic scenes.")
+    parser.add_argument('--dataset', default="D:/Proyectos/Pokemon_TCG_Scanner/datasets/synthetic_dataset")
+    parser.add_argument('--cards', default="D:/Proyectos/Pokemon_TCG_Scanner/datasets/images/cards",
+                        help="Card images the dataset was generated from; they form the catalog")
+    parser.add_argument('--split', help="Only evaluate the images of this split, e.g. test")
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--weights', nargs='+', default=["weights/best_1.pt"], help="One entry per backend to compare")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[640])
+    parser.add_argument('--confidences', type=float, nargs='+', default=[0.9])
+    parser.add_argument('--ious', type=float, nargs='+', default=[0.8])
+    parser.add_argument('--hash-sizes', type=int, nargs='+', default=[16])
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[168 / 512],
+                        help="Match thresholds as a fraction of the hash bits; the default is the scanner's 168 of 512")
+    parser.add_argument('--output', help="Also write the rows as JSON")
+    args = parser.parse_args()
+
+    scenes = load_scenes(args.dataset, args.split, args.limit)
+    images = [utils.read_image(scene['path']) for scene in scenes]
+    rows = evaluate(scenes, images, args.cards, args.weights, args.sizes, args.confidences, args.ious,
+                    args.hash_sizes, args.thresholds)
+    print_table(rows)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(rows, file, indent=2)
@@ -4,11 +4,13 @@ import os
 import json
 import re
 import sys
-import imagehash
+import numpy as np
 from PIL import Image
 from io import BytesIO
 from tqdm import tqdm
 
+import hashing
+
 
 def sanitize_filename(filename):
     invalid_chars = r'[<>:"/\\|?*\x00-\x1F]'
@@ -258,12 +260,10 @@ def solve_errors(dir):
     with open(os.path.join(dir, 'log.json'), 'w') as file:
         json.dump(log_data, file, indent=4)
 
-def hash_image(img, hash_size):
-    img = img.convert('RGB')
-    dhash = imagehash.dhash(img, hash_size)
-    phash = imagehash.phash(img, hash_size)
-
-    return f'{dhash}{phash}'
+def hash_image_rotations(img, hash_size):
+    img = np.asarray(img.convert('RGB'))
+    hashes = hashing.hash_images([img, img[::-1, ::-1]], hash_size)
+    return hashing.bits_to_hex(hashes[0]), hashing.bits_to_hex(hashes[1])
 
 def add_hash_column(dir, save_per=100):
     log_path = os.path.join(dir, 'log.json')
@@ -277,27 +277,32 @@ def add_hash_column(dir, save_per=100):
 
     if 'hash' not in df.columns:
         df['hash'] = None
+    if 'hash_rotated' not in df.columns:
+        df['hash_rotated'] = None
 
     count_since_last_save = 0
     for index in tqdm(range(last_index, len(df)), initial=last_index, desc="Procesando imágenes"):
         row = df.iloc[index]
-        if pd.notna(row['hash']):
+        if pd.notna(row['hash']) and pd.notna(row['hash_rotated']):
             continue
 
         url = row['Image_Card_URL']
 
         if pd.isna(url):
             df.at[index, 'hash'] = None
+            df.at[index, 'hash_rotated'] = None
         else:
             try:
                 response = requests.get(url, timeout=10)
                 response.raise_for_status()
                 img = Image.open(BytesIO(response.content))
-                hash_val = hash_image(img, 16)
+                hash_val, hash_rotated = hash_image_rotations(img, 16)
                 df.at[index, 'hash'] = hash_val
+                df.at[index, 'hash_rotated'] = hash_rotated
             except Exception as e:
                 print(f"Error en fila {index} con URL '{url}': {e}")
                 df.at[index, 'hash'] = None
+                df.at[index, 'hash_rotated'] = None
 
         count_since_last_save += 1
 
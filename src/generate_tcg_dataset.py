@@ -5,14 +5,19 @@ import numpy as np
 import json
 import uuid
 import shutil
-from shapely.geometry import Polygon
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
 from tqdm import tqdm
 
 
 def load_images(folder):
-    return [os.path.join(folder, filename) for filename in os.listdir(folder)]
+    # Sorted so a seed gives the same dataset on every filesystem
+    return [os.path.join(folder, filename) for filename in sorted(os.listdir(folder))]
 
-def generate_name():
+def generate_name(rng=None):
+    if rng is not None:
+        return uuid.UUID(int=rng.getrandbits(128), version=4).hex
     random_uuid = str(uuid.uuid4().hex)
     return random_uuid
 
@@ -36,31 +41,73 @@ def get_card_contour(mask):
         return max(contours, key=cv2.contourArea)
     return None
 
-def place_cards_on_background(background, cards, margin=20):
-    background = cv2.imread(background, cv2.IMREAD_COLOR)
+class AssetCache():
+
+    # Decoded backgrounds and cards, least recently used evicted first once
+    # max_bytes is reached; every worker process holds its own. With
+    # card_scale < 1 cards are kept pre-downscaled so more of a large catalog
+    # fits, while placed sizes still follow the original card size.
+    def __init__(self, max_bytes=512 * 2**20, card_scale=1.0):
+        self.max_bytes = max_bytes
+        self.card_scale = card_scale
+        self.assets = OrderedDict()
+        self.n_bytes = 0
+
+    def get(self, key, load):
+        if key in self.assets:
+            self.assets.move_to_end(key)
+            return self.assets[key]
+        asset = load()
+        size = asset[0].nbytes
+        if size <= self.max_bytes:
+            while self.n_bytes + size > self.max_bytes:
+                self.n_bytes -= self.assets.popitem(last=False)[1][0].nbytes
+            self.assets[key] = asset
+            self.n_bytes += size
+        return asset
+
+    def background(self, path):
+        # Cards are blended into the background in place, so callers get a copy
+        return self.get(('background', path), lambda: (cv2.imread(path, cv2.IMREAD_COLOR),))[0].copy()
+
+    def card(self, path):
+        # BGRA with the original (width, height)
+        return self.get(('card', path), lambda: self.load_card(path))
+
+    def load_card(self, path):
+        card = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if card.shape[2] == 3:
+            card = cv2.cvtColor(card, cv2.COLOR_BGR2BGRA)
+        h, w = card.shape[:2]
+        if self.card_scale < 1:
+            card = cv2.resize(card, (int(w * self.card_scale), int(h * self.card_scale)), interpolation=cv2.INTER_AREA)
+        return card, (w, h)
+
+def place_cards_on_background(background, cards, margin=20, rng=random, cache=None, contour_epsilon=None):
+    # Without a cache every image is decoded again
+    cache = cache or AssetCache(max_bytes=0)
+    background = cache.background(background)
     h_bg, w_bg, _ = background.shape
 
-    scale_factor = random.uniform(0.5, 1.0)
+    scale_factor = rng.uniform(0.5, 1.0)
 
     placed_cards, annotation_data = [], []
     mask_overlay = np.zeros((h_bg, w_bg), dtype=np.uint8)
     
     for card_path in cards:
-        card = cv2.imread(card_path, cv2.IMREAD_UNCHANGED)
-        h_card, w_card = card.shape[:2]
+        card, (w_card, h_card) = cache.card(card_path)
         
         w_card, h_card = int(w_card * scale_factor), int(h_card * scale_factor)
         card_resized = cv2.resize(card, (w_card, h_card))
         
-        alpha = card_resized[:, :, 3] if card.shape[2] == 4 else np.ones((h_card, w_card), dtype=np.uint8) * 255
-        
-        angle = random.uniform(-180, 180)
+        angle = rng.uniform(-180, 180)
+        # Colour and alpha rotate together in one warp
         card_rotated = rotate_image_keep_size(card_resized, angle)
-        alpha_rotated = rotate_image_keep_size(alpha, angle)
+        alpha_rotated = card_rotated[:, :, 3]
         h_rot, w_rot = card_rotated.shape[:2]
 
         for _ in range(50):
-            x_pos, y_pos = random.randint(margin, w_bg - w_rot - margin), random.randint(margin, h_bg - h_rot - margin)
+            x_pos, y_pos = rng.randint(margin, w_bg - w_rot - margin), rng.randint(margin, h_bg - h_rot - margin)
             overlap = any(
                 (x_pos < px + pw and x_pos + w_rot > px and
                 y_pos < py + ph and y_pos + h_rot > py)
@@ -69,18 +116,18 @@ def place_cards_on_background(background, cards, margin=20):
             if not overlap:
                 placed_cards.append((x_pos, y_pos, w_rot, h_rot))
 
-                alpha_mask = alpha_rotated / 255.0
-
-                for c in range(3):
-                    background[y_pos:y_pos+h_rot, x_pos:x_pos+w_rot, c] = (
-                        card_rotated[:, :, c] * alpha_mask +
-                        background[y_pos:y_pos+h_rot, x_pos:x_pos+w_rot, c] * (1 - alpha_mask)
-                    )
+                alpha_mask = alpha_rotated.astype(np.float32) / 255
+                roi = background[y_pos:y_pos+h_rot, x_pos:x_pos+w_rot]
+                roi[:] = cv2.blendLinear(card_rotated[:, :, :3], roi, alpha_mask, 1 - alpha_mask)
 
                 card_mask = np.zeros((h_rot, w_rot), dtype=np.uint8)
                 card_mask[alpha_rotated > 0] = 255
                 
                 contour = get_card_contour(card_mask)
+                if contour is not None and contour_epsilon:
+                    # Simplified in pixels while the contour is still integer,
+                    # so the labels need no simplification pass afterwards
+                    contour = cv2.approxPolyDP(contour, contour_epsilon, True)
                 if contour is not None:
                     contour[:, 0, 0] += x_pos
                     contour[:, 0, 1] += y_pos
@@ -89,32 +136,119 @@ def place_cards_on_background(background, cards, margin=20):
                     annotation_data.append({
                         "bbox": [x_pos, y_pos, w_rot, h_rot],
                         "category_id": 0,
-                        "segmentation": [segmentation]
+                        "segmentation": [segmentation],
+                        # Identity of the placed card, used by evaluate.py
+                        "card_file": os.path.basename(card_path)
                     })
                     cv2.fillPoly(mask_overlay, [contour], 255)
                 break
     
     return background, annotation_data, mask_overlay, w_bg, h_bg
 
-def generate_synthetic_dataset(bg_folder, card_folder, output_folder, P):
+scene_worker = {}
+
+def init_scene_worker(backgrounds, cards, output_folder, seed, cache_mb=512, card_scale=1.0, split_names=None, scene_splits=None,
+                      tolerance=0.001, contour_epsilon=None):
+    scene_worker.update(backgrounds=backgrounds, cards=cards, output_folder=output_folder, seed=seed,
+                        cache=AssetCache(cache_mb * 2**20, card_scale),
+                        split_names=split_names, scene_splits=scene_splits, tolerance=tolerance, contour_epsilon=contour_epsilon)
+
+def scene_seed(seed, i):
+    # Derived from the master seed and the scene number only, so the dataset
+    # does not depend on how scenes are spread over workers
+    return int(np.random.SeedSequence([seed, i]).generate_state(1)[0])
+
+def assign_splits(P, splits, seed):
+    # Same proportions as split_dataset, fixed by the master seed. Any
+    # remainder from rounding goes to the last split.
+    counts = [int(splits[split] * P) for split in list(splits)[:-1]]
+    scene_splits = np.repeat(np.arange(len(splits), dtype=np.int8), counts + [P - sum(counts)])
+    np.random.default_rng(seed).shuffle(scene_splits)
+    return scene_splits
+
+def generate_scene(i):
+    backgrounds, cards, output_folder = scene_worker['backgrounds'], scene_worker['cards'], scene_worker['output_folder']
+    rng = random.Random(scene_seed(scene_worker['seed'], i))
+
+    bg, selected_cards = rng.choice(backgrounds), rng.sample(cards, rng.randint(1, min(5, len(cards))))
+    img, annotations, mask, w_image, h_image = place_cards_on_background(bg, selected_cards, rng=rng, cache=scene_worker['cache'],
+                                                                         contour_epsilon=scene_worker['contour_epsilon'])
+
+    image_id = generate_name(rng)
+    json_data = {"image_id": image_id, "height_image": h_image, "width_image": w_image, "annotations": annotations}
+    
+    if scene_worker['split_names'] is None:
+        cv2.imwrite(f"{output_folder}/images/{image_id}.jpg", img)
+    else:
+        # Streamed straight into its split with the final, simplified label
+        split = scene_worker['split_names'][scene_worker['scene_splits'][i]]
+        cv2.imwrite(f"{output_folder}/splited_dataset/{split}/images/{image_id}.jpg", img)
+        lines = yolo_lines(json_data, mode="segmentation")
+        if scene_worker['tolerance']:
+            lines = simplify_label_lines(lines, scene_worker['tolerance'])
+        with open(f"{output_folder}/splited_dataset/{split}/labels/{image_id}.txt", "w") as f:
+            f.write('\n'.join(lines))
+    cv2.imwrite(f"{output_folder}/masks/{image_id}.png", mask)
+    
+    with open(f"{output_folder}/annotations/{image_id}.json", "w") as f:
+        json.dump(json_data, f, indent=4)
+    return image_id
+
+def generate_synthetic_dataset(bg_folder, card_folder, output_folder, P, workers=1, seed=None, cache_mb=512, card_scale=1.0,
+                               splits=None, class_names=('card',), tolerance=0.001, contour_epsilon=None):
+    # With splits, e.g. {'train': 0.8, 'val': 0.1, 'test': 0.1}, every scene is
+    # written directly as a YOLO dataset (split images, simplified segmentation
+    # labels and data.yaml), so convert_coco_to_yolo and split_dataset are not needed.
+    # contour_epsilon (pixels) simplifies each card contour as it is placed;
+    # tolerance=None then skips simplifying the labels again.
     backgrounds, cards = load_images(bg_folder), load_images(card_folder)
     os.makedirs(f"{output_folder}", exist_ok=True)
-    os.makedirs(f"{output_folder}/images", exist_ok=True)
     os.makedirs(f"{output_folder}/annotations", exist_ok=True)
     os.makedirs(f"{output_folder}/masks", exist_ok=True)
-    
-    for i in tqdm(range(P), desc="Creating Images"):
-        bg, selected_cards = random.choice(backgrounds), random.sample(cards, random.randint(1, min(5, len(cards))))
-        img, annotations, mask, w_image, h_image = place_cards_on_background(bg, selected_cards)
 
-        image_id = generate_name()
-        
-        cv2.imwrite(f"{output_folder}/images/{image_id}.jpg", img)
-        cv2.imwrite(f"{output_folder}/masks/{image_id}.png", mask)
-        
-        json_data = {"image_id": image_id, "height_image": h_image, "width_image": w_image, "annotations": annotations}
-        with open(f"{output_folder}/annotations/{image_id}.json", "w") as f:
-            json.dump(json_data, f, indent=4)
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    print(f"Master seed: {seed}")
+
+    split_names = scene_splits = None
+    if splits is None:
+        os.makedirs(f"{output_folder}/images", exist_ok=True)
+    else:
+        assert sum([splits[s] for s in splits]) == 1.0
+        split_names, scene_splits = list(splits), assign_splits(P, splits, seed)
+        for split in splits:
+            os.makedirs(os.path.join(output_folder, 'splited_dataset', split, 'images'), exist_ok=True)
+            os.makedirs(os.path.join(output_folder, 'splited_dataset', split, 'labels'), exist_ok=True)
+        write_data_yaml(output_folder, splits, class_names)
+
+    initargs = (backgrounds, cards, output_folder, seed, cache_mb, card_scale, split_names, scene_splits, tolerance, contour_epsilon)
+    start = time.perf_counter()
+    if workers == 1:
+        init_scene_worker(*initargs)
+        for i in tqdm(range(P), desc="Creating Images"):
+            generate_scene(i)
+    else:
+        with Pool(workers, initializer=init_scene_worker, initargs=initargs) as pool:
+            for _ in tqdm(pool.imap_unordered(generate_scene, range(P), chunksize=8), total=P, desc="Creating Images"):
+                pass
+    elapsed = time.perf_counter() - start
+    print(f"Created {P} images in {elapsed:.1f}s: {P / elapsed:.2f} images/s")
+
+def yolo_lines(data, mode="bbox"):
+    h_image = data["height_image"]
+    w_image = data["width_image"]
+    lines = []
+    for ann in data["annotations"]:
+        n_class = ann["category_id"]
+        if mode == "bbox":
+            x, y, w, h = ann["bbox"]
+            x_center, y_center, w_norm, h_norm = (x + w/2)/w_image, (y + h/2)/h_image, w/w_image, h/h_image
+            lines.append(f"{n_class} {x_center} {y_center} {w_norm} {h_norm}")
+        elif mode == "segmentation":
+            seg = ann["segmentation"][0]
+            seg_str = " ".join(map(str, [v/w_image if i%2==0 else v/h_image for i, v in enumerate(seg)]))
+            lines.append(f"{n_class} {seg_str}")
+    return lines
 
 def convert_coco_to_yolo(annotation_folder, label_folder, mode="bbox"):
     os.makedirs(label_folder, exist_ok=True)
@@ -124,18 +258,7 @@ def convert_coco_to_yolo(annotation_folder, label_folder, mode="bbox"):
         
         txt_path = os.path.join(label_folder, file.replace(".json", ".txt"))
         with open(txt_path, "w") as f:
-            h_image = data["height_image"]
-            w_image = data["width_image"]
-            for ann in data["annotations"]:
-                n_class = ann["category_id"]
-                if mode == "bbox":
-                    x, y, w, h = ann["bbox"]
-                    x_center, y_center, w_norm, h_norm = (x + w/2)/w_image, (y + h/2)/h_image, w/w_image, h/h_image
-                    f.write(f"{n_class} {x_center} {y_center} {w_norm} {h_norm}\n")
-                elif mode == "segmentation":
-                    seg = ann["segmentation"][0]
-                    seg_str = " ".join(map(str, [v/w_image if i%2==0 else v/h_image for i, v in enumerate(seg)]))
-                    f.write(f"{n_class} {seg_str}\n")
+            f.write("".join(line + "\n" for line in yolo_lines(data, mode)))
 
 def visualize_annotations(image_path, annotation_path):
     image = cv2.imread(image_path)
@@ -153,65 +276,114 @@ def visualize_annotations(image_path, annotation_path):
     cv2.waitKey(0)
     cv2.destroyAllWindows()
 
-def split_dataset(splits, path, class_names):
+def write_data_yaml(path, splits, class_names):
+    splits_rows = []
+    for split in splits:
+        splits_rows.append(f'{split}: {os.path.join(path, "splited_dataset", split, "images")}     # {split} images\n')
+
+    formatted_names = "\n" + "\n".join([f"  {i}: {name}" for i, name in enumerate(class_names)])
+    splits_path = "".join(splits_rows)
+    yaml_file = """{}\nis_coco: False\n\n# Classes\nnames:{}""".format(splits_path, formatted_names)
+    with open(os.path.join(path, 'splited_dataset','data.yaml'), 'w') as file1:
+        file1.write(yaml_file)
+
+def link_file(src, dst):
+    # A hardlink costs no data I/O. Symlinks cover filesystems without
+    # hardlinks, and a copy is the last resort (e.g. Windows across drives
+    # without symlink rights).
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(src), dst)
+        except OSError:
+            shutil.copy(src, dst)
+
+def split_dataset(splits, path, class_names, tolerance=0.001, workers=1, engine='cv2'):
+    # For datasets generated without splits. Images are linked into place and
+    # each label is simplified while it is written to its split, so the source
+    # labels are read once and never rewritten.
     assert sum([splits[s] for s in splits]) == 1.0
     os.makedirs(os.path.join(path, 'splited_dataset'), exist_ok=True)
     names = os.listdir(os.path.join(path, 'images'))
     random.seed(0)
     random.shuffle(names)
     last = 0
-    splits_rows = []
     for split in splits:
-        splits_rows.append(f'{split}: {os.path.join(path, 'splited_dataset', split, 'images')}     # {split} images\n')
         os.makedirs(os.path.join(path, 'splited_dataset', split), exist_ok=True)
         os.makedirs(os.path.join(path, 'splited_dataset', split, 'images'), exist_ok=True)
         os.makedirs(os.path.join(path, 'splited_dataset', split, 'labels'), exist_ok=True)
+        jobs = []
         for i in tqdm(range(last, int(splits[split] * len(names)) + last), desc=f"Creating Split - {split}"):
-            shutil.copy(os.path.join(path, 'images', names[i]), os.path.join(path, 'splited_dataset', split, 'images', names[i]))
-            shutil.copy(os.path.join(path, 'labels', names[i].split('.')[0] + '.txt'), os.path.join(path, 'splited_dataset', split, 'labels', names[i].split('.')[0] + '.txt'))
-        last = int(splits[split] * len(names))
-        simplify_all_segmentations(os.path.join(path, 'splited_dataset', split, 'labels'))
+            link_file(os.path.join(path, 'images', names[i]), os.path.join(path, 'splited_dataset', split, 'images', names[i]))
+            label = names[i].split('.')[0] + '.txt'
+            jobs.append((os.path.join(path, 'labels', label), os.path.join(path, 'splited_dataset', split, 'labels', label), tolerance, engine))
+        simplify_label_files(jobs, workers, desc=f"Optimizing split labels - {split}")
+        last += int(splits[split] * len(names))
 
-    formatted_names = "\n" + "\n".join([f"  {i}: {name}" for i, name in enumerate(class_names)])
-    splits_path = "".join(splits_rows)
-    yaml_file = """{}\nis_coco: False\n\n# Classes\nnames:{}""".format(splits_path, formatted_names)
-    with open(os.path.join(path, 'splited_dataset','data.yaml'), 'w') as file1:
-        file1.write(yaml_file)
+    write_data_yaml(path, splits, class_names)
 
-def simplify_segmentation(points, tolerance):
+def simplify_segmentation(points, tolerance, engine='cv2'):
     coords = np.array(points).reshape(-1, 2)
-    poly = Polygon(coords)
+    if engine == 'shapely':
+        from shapely.geometry import Polygon
+        poly = Polygon(coords)
 
-    if not poly.is_valid or poly.is_empty:
-        return points
+        if not poly.is_valid or poly.is_empty:
+            return points
+
+        simplified = poly.simplify(tolerance, preserve_topology=True)
 
-    simplified = poly.simplify(tolerance, preserve_topology=True)
+        simplified_coords = np.array(simplified.exterior.coords[:-1])
+        return simplified_coords.flatten().tolist()
 
-    simplified_coords = np.array(simplified.exterior.coords[:-1])
-    return simplified_coords.flatten().tolist()
+    if len(coords) < 4:
+        return points
+    # Douglas-Peucker on the closed ring. approxPolyDP works in float32 and
+    # only keeps input vertices, so they are looked up again (each x, y pair
+    # viewed as one uint64) to write the original float64 values.
+    coords32 = coords.astype(np.float32)
+    kept = cv2.approxPolyDP(coords32, tolerance, True).reshape(-1, 2)
+    keep = np.isin(coords32.view(np.uint64).ravel(), np.ascontiguousarray(kept).view(np.uint64).ravel())
+    return coords[keep].flatten().tolist()
 
-def simplify_all_segmentations(label_dir, tolerance=0.001):
-    for fname in tqdm(os.listdir(label_dir), desc=f"Optimizing split labels"):
-        if not fname.endswith('.txt'):
-            continue
+def simplify_label_lines(lines, tolerance=0.001, engine='cv2'):
+    simplified_lines = []
+    for line in lines:
+        parts = line.strip().split()
+        cls = parts[0]
+        coords = list(map(float, parts[1:]))
 
-        fpath = os.path.join(label_dir, fname)
+        simplified_coords = simplify_segmentation(coords, tolerance, engine)
+        simplified_line = cls + ' ' + ' '.join(map(str, simplified_coords))
+        simplified_lines.append(simplified_line)
+    return simplified_lines
 
-        with open(fpath, 'r') as file:
-            lines = file.readlines()
+def simplify_label_file(job):
+    src, dst, tolerance, engine = job
+    with open(src, 'r') as file:
+        lines = file.readlines()
 
-        simplified_lines = []
-        for line in lines:
-            parts = line.strip().split()
-            cls = parts[0]
-            coords = list(map(float, parts[1:]))
+    with open(dst, 'w') as file:
+        file.write('\n'.join(simplify_label_lines(lines, tolerance, engine)))
 
-            simplified_coords = simplify_segmentation(coords, tolerance)
-            simplified_line = cls + ' ' + ' '.join(map(str, simplified_coords))
-            simplified_lines.append(simplified_line)
+def simplify_label_files(jobs, workers=1, desc="Optimizing labels"):
+    if workers == 1:
+        for job in tqdm(jobs, desc=desc):
+            simplify_label_file(job)
+    else:
+        with Pool(workers) as pool:
+            for _ in tqdm(pool.imap_unordered(simplify_label_file, jobs, chunksize=64), total=len(jobs), desc=desc):
+                pass
 
-        with open(fpath, 'w') as file:
-            file.write('\n'.join(simplified_lines))
+def simplify_all_segmentations(label_dir, tolerance=0.001, workers=1, engine='cv2'):
+    # Rewrites the labels in place; engine='shapely' is the previous
+    # topology-preserving simplification, kept for comparison
+    jobs = [(os.path.join(label_dir, fname), os.path.join(label_dir, fname), tolerance, engine)
+            for fname in os.listdir(label_dir) if fname.endswith('.txt')]
+    simplify_label_files(jobs, workers, desc="Optimizing split labels")
         
 if __name__ == "__main__":
     output_folder = "D:/Proyectos/Pokemon_TCG_Scanner/datasets/synthetic_dataset"
@@ -219,13 +391,9 @@ if __name__ == "__main__":
     generate_synthetic_dataset("D:/Proyectos/Pokemon_TCG_Scanner/datasets/images/background", 
                             "D:/Proyectos/Pokemon_TCG_Scanner/datasets/images/cards", 
                             output_folder, 
-                            1500)
-    
-    convert_coco_to_yolo(f"{output_folder}/annotations", 
-                        f"{output_folder}/labels", 
-                        mode="segmentation")
-
-    split_dataset({'train': 0.8, 'val': 0.1, 'test': 0.1}, 
-                  output_folder,
-                  ['card'])
+                            1500,
+                            workers=os.cpu_count(),
+                            seed=0,
+                            splits={'train': 0.8, 'val': 0.1, 'test': 0.1},
+                            class_names=['card'])
     
\ No newline at end of file
@@ -0,0 +1,144 @@
+import numpy as np
+
+import utils
+
+CHUNK_BITS = 16
+
+def chunk_masks(max_radius):
+    values = np.arange(1 << CHUNK_BITS, dtype=np.uint32)
+    weights = utils.popcount(values)
+    return [values[weights == r].astype(np.int32) for r in range(max_radius + 1)]
+
+def split_chunks(matrix):
+    return np.ascontiguousarray(matrix).view(np.uint16).astype(np.int32)
+
+def gather_ranges(starts, ends):
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), lengths
+    firsts = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - firsts, lengths) + np.arange(total)
+    return positions, lengths
+
+def build_tables(hashes):
+    chunks = split_chunks(hashes)
+    n, n_tables = chunks.shape
+    order = np.argsort(chunks, axis=0, kind='stable')
+    ids = order.T.astype(np.int64).ravel()
+    counts = np.zeros((n_tables, (1 << CHUNK_BITS) + 1), dtype=np.int64)
+    for t in range(n_tables):
+        counts[t, 1:] = np.bincount(chunks[:, t], minlength=1 << CHUNK_BITS)
+    offsets = np.cumsum(counts, axis=1) + np.arange(n_tables)[:, None] * n
+    return ids, offsets
+
+class HashIndex():
+
+    # Multi-index hashing: every hash is split into 16-bit substrings and each
+    # substring position gets its own lookup table. Two hashes at distance d
+    # share at least one substring within floor(d / n_tables) bits, so probing
+    # every table up to radius r finds every hash closer than n_tables * (r + 1).
+    # Queries not settled within max_radius are finished with a linear scan, so
+    # results match brute force. exhaustive=False skips that scan: faster, but
+    # approximate for thresholds or k-th neighbours beyond guaranteed_radius(max_radius).
+    def __init__(self, hashes, max_radius=2, exhaustive=True, linear_ratio=0.05, tables=None):
+        self.hashes = hashes
+        self.max_radius = max_radius
+        self.exhaustive = exhaustive
+        self.linear_ratio = linear_ratio
+        self.masks = chunk_masks(max_radius)
+        self.ids, self.offsets = tables if tables is not None else build_tables(hashes)
+        self.n_tables = len(self.offsets)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def guaranteed_radius(self, r):
+        return self.n_tables * (r + 1) - 1
+
+    def candidates(self, queries, k, threshold):
+        queries = utils.pack_hashes(queries)
+        chunks = split_chunks(queries)
+        tables = np.arange(self.n_tables)[None, :, None]
+        active = np.arange(len(queries))
+        linear = np.empty(0, dtype=np.int64)
+        found_q, found_c, found_d = [], [], []
+
+        for r, masks in enumerate(self.masks):
+            # Once probing touches a large share of the catalog a linear scan is cheaper
+            if masks.size * self.n_tables > self.linear_ratio * len(self):
+                linear = np.concatenate([linear, active])
+                active = active[:0]
+                break
+
+            keys = chunks[active, :, None] ^ masks[None, None, :]
+            starts, ends = self.offsets[tables, keys], self.offsets[tables, keys + 1]
+            cost = (ends - starts).reshape(len(active), -1).sum(axis=1) + masks.size * self.n_tables
+            expensive = cost > self.linear_ratio * len(self)
+            linear = np.concatenate([linear, active[expensive]])
+            active, starts, ends = active[~expensive], starts[~expensive], ends[~expensive]
+
+            positions, lengths = gather_ranges(starts.ravel(), ends.ravel())
+            q = np.repeat(np.repeat(active, masks.size * self.n_tables), lengths)
+            c = self.ids[positions]
+            d = utils.popcount(queries[q] ^ self.hashes[c]).sum(axis=1, dtype=np.int32)
+            found_q.append(q)
+            found_c.append(c)
+            found_d.append(d)
+
+            radius = self.guaranteed_radius(r)
+            if threshold is not None and radius >= threshold - 1:
+                active = active[:0]
+                break
+            if k is not None:
+                close = np.concatenate([fq[fd <= radius] * len(self) + fc[fd <= radius] for fq, fc, fd in zip(found_q, found_c, found_d)])
+                settled = np.bincount(np.unique(close) // len(self), minlength=len(queries))
+                active = active[settled[active] < k]
+            if len(active) == 0:
+                break
+
+        if self.exhaustive:
+            linear = np.concatenate([linear, active])
+        if len(linear):
+            d = utils.hamming_distances(queries[linear], self.hashes)
+            if k is None:
+                q, c = np.nonzero(d < threshold) if threshold is not None else np.indices(d.shape).reshape(2, -1)
+            else:
+                c = d.argmin(axis=1)[:, None] if k == 1 else np.argsort(d, axis=1)[:, :k]
+                q, c = np.repeat(np.arange(len(linear)), c.shape[1]), c.ravel()
+            found_q.append(linear[q])
+            found_c.append(c)
+            found_d.append(d[q, c])
+
+        q, c, d = np.concatenate(found_q), np.concatenate(found_c), np.concatenate(found_d)
+        order = np.lexsort((c, q))
+        q, c, d = q[order], c[order], d[order]
+        unique = np.ones(len(q), dtype=bool)
+        unique[1:] = (q[1:] != q[:-1]) | (c[1:] != c[:-1])
+        return q[unique], c[unique], d[unique]
+
+    def search(self, queries, k=1, threshold=None):
+        n_queries = len(np.atleast_2d(queries))
+        q, c, d = self.candidates(queries, k, threshold)
+        if threshold is not None:
+            keep = d < threshold
+            q, c, d = q[keep], c[keep], d[keep]
+
+        order = np.lexsort((c, d, q))
+        q, c, d = q[order], c[order], d[order]
+        rank = np.arange(len(q)) - np.searchsorted(q, q)
+        keep = rank < k
+        ids = np.full((n_queries, k), -1, dtype=np.int64)
+        distances = np.full((n_queries, k), np.iinfo(np.int32).max, dtype=np.int32)
+        ids[q[keep], rank[keep]] = c[keep]
+        distances[q[keep], rank[keep]] = d[keep]
+        return ids, distances
+
+    def within(self, queries, threshold):
+        n_queries = len(np.atleast_2d(queries))
+        q, c, d = self.candidates(queries, None, threshold)
+        keep = d < threshold
+        q, c, d = q[keep], c[keep], d[keep]
+        order = np.lexsort((c, d, q))
+        splits = np.searchsorted(q[order], np.arange(1, n_queries))
+        return list(zip(np.split(c[order], splits), np.split(d[order], splits)))
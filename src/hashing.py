@@ -0,0 +1,88 @@
+from functools import lru_cache
+import cv2
+import numpy as np
+import scipy.fftpack
+
+# Mirrors Pillow's fixed-point LANCZOS resampling and 'L' conversion so the
+# hashes are bit-identical to imagehash.dhash / imagehash.phash
+PRECISION_BITS = 32 - 8 - 2
+LANCZOS_SUPPORT = 3.0
+GRAY_WEIGHTS = np.array([[19595, 38470, 7471]], dtype=np.float32)
+
+def lanczos(x):
+    return np.where((-LANCZOS_SUPPORT <= x) & (x < LANCZOS_SUPPORT), np.sinc(x) * np.sinc(x / LANCZOS_SUPPORT), 0.0)
+
+@lru_cache(maxsize=None)
+def resample_weights(in_size, out_size):
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = LANCZOS_SUPPORT * filterscale
+    weights = np.zeros((out_size, in_size))
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size)
+        k = lanczos((np.arange(xmin, xmax) - center + 0.5) * (1.0 / filterscale))
+        total = 0.0
+        for w in k:
+            total += w
+        if total != 0.0:
+            k = k / total
+        weights[xx, xmin:xmax] = np.trunc(k * (1 << PRECISION_BITS) + np.where(k < 0, -0.5, 0.5))
+    # Integer-valued float64 weights keep every product and sum exact under BLAS
+    return weights.T.copy()
+
+def resample_pass(pixels, weights):
+    acc = (pixels @ weights).astype(np.int64) + (1 << (PRECISION_BITS - 1))
+    return np.clip(acc >> PRECISION_BITS, 0, 255).astype(np.float64)
+
+def resize(gray, width, height):
+    pixels = gray
+    if pixels.shape[-1] != width:
+        pixels = resample_pass(pixels, resample_weights(pixels.shape[-1], width))
+    if pixels.shape[-2] != height:
+        pixels = resample_pass(pixels.swapaxes(-1, -2), resample_weights(pixels.shape[-2], height)).swapaxes(-1, -2)
+    return pixels
+
+def to_gray(images):
+    if images.ndim == 3:
+        return images.astype(np.float64)
+    gray = np.empty(images.shape[:3], dtype=np.float64)
+    for i, img in enumerate(images):
+        # Every partial sum stays below 2**24, so float32 holds Pillow's fixed-point values exactly
+        weighted = cv2.transform(np.float32(img[..., :3]), GRAY_WEIGHTS)
+        gray[i] = np.floor((weighted + 0x8000) * (1 / 65536))
+    return gray
+
+def dhash(gray, hash_size):
+    pixels = resize(gray, hash_size + 1, hash_size)
+    return pixels[..., 1:] > pixels[..., :-1]
+
+def phash(gray, hash_size, highfreq_factor=4):
+    img_size = hash_size * highfreq_factor
+    pixels = resize(gray, img_size, img_size)
+    # Same transform as imagehash, batched along the first axis
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=-2), axis=-1)
+    dctlowfreq = dct[:, :hash_size, :hash_size]
+    med = np.median(dctlowfreq.reshape(len(dctlowfreq), -1), axis=1)
+    return dctlowfreq > med[:, None, None]
+
+def hash_stack(images, hash_size):
+    gray = to_gray(images)
+    bits = np.concatenate([dhash(gray, hash_size).reshape(len(gray), -1),
+                           phash(gray, hash_size).reshape(len(gray), -1)], axis=1)
+    return np.packbits(bits, axis=1)
+
+def hash_images(images, hash_size):
+    if len(images) == 0:
+        return np.empty((0, (2 * hash_size * hash_size + 7) // 8), dtype=np.uint8)
+    shapes = {}
+    for i, img in enumerate(images):
+        shapes.setdefault(img.shape, []).append(i)
+    hashes = np.empty((len(images), (2 * hash_size * hash_size + 7) // 8), dtype=np.uint8)
+    for ids in shapes.values():
+        hashes[ids] = hash_stack(np.stack([images[i] for i in ids]), hash_size)
+    return hashes
+
+def bits_to_hex(bits):
+    return bits.tobytes().hex()
@@ -0,0 +1,118 @@
+import queue
+import threading
+import cv2
+import numpy as np
+
+class FrameQueue():
+
+    # Bounded hand-off between stages. With drop_oldest a full queue discards
+    # its oldest frame instead of blocking, which keeps live latency bounded.
+    def __init__(self, maxsize, drop_oldest=False):
+        self.queue = queue.Queue(maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+
+    def put(self, item, stop):
+        while not stop.is_set():
+            try:
+                self.queue.put(item, block=not self.drop_oldest, timeout=0.05)
+                return True
+            except queue.Full:
+                if self.drop_oldest:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        return False
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+class Pipeline():
+
+    # capture thread -> frames -> inference thread -> results -> display (caller)
+    # The inference thread takes up to batch_size frames per call. A None item
+    # marks the end of the stream.
+    def __init__(self, read_frame, process_frames, queue_size=2, drop_oldest=False, batch_size=1):
+        self.read_frame = read_frame
+        self.process_frames = process_frames
+        self.batch_size = batch_size
+        self.frames = FrameQueue(max(queue_size, batch_size), drop_oldest)
+        self.results = FrameQueue(queue_size, drop_oldest)
+        self.stop_event = threading.Event()
+        self.threads = [threading.Thread(target=self.capture, daemon=True),
+                        threading.Thread(target=self.infer, daemon=True)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout=2.0):
+        # Bounded, a camera read or a model call in flight may take a moment to return
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def capture(self):
+        try:
+            while not self.stop_event.is_set():
+                frame = self.read_frame()
+                if frame is None:
+                    break
+                self.frames.put(frame, self.stop_event)
+        finally:
+            self.frames.put(None, self.stop_event)
+
+    def next_batch(self):
+        batch = []
+        while len(batch) < self.batch_size and not self.stop_event.is_set():
+            try:
+                frame = self.frames.get(timeout=0.05)
+            except queue.Empty:
+                # Live sources never wait for a full batch
+                if batch and self.frames.drop_oldest:
+                    break
+                continue
+            if frame is None:
+                return batch, True
+            batch.append(frame)
+        return batch, False
+
+    def infer(self):
+        try:
+            finished = False
+            while not finished and not self.stop_event.is_set():
+                batch, finished = self.next_batch()
+                if batch:
+                    for result in self.process_frames(batch):
+                        self.results.put(result, self.stop_event)
+        finally:
+            self.results.put(None, self.stop_event)
+
+class MotionGate():
+
+    # Compares a small grayscale copy of each frame with the last frame that
+    # was processed. Frames whose mean absolute difference stays under
+    # threshold are static and can reuse the previous results.
+    def __init__(self, threshold=3.0, size=64):
+        self.threshold = threshold
+        self.size = size
+        self.reference = None
+        self.gated = 0
+        self.processed = 0
+
+    def static(self, img):
+        small = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), (self.size, self.size), interpolation=cv2.INTER_AREA)
+        small = small.astype(np.float32)
+        if self.reference is not None and np.abs(small - self.reference).mean() < self.threshold:
+            self.gated += 1
+            return True
+        self.reference = small
+        self.processed += 1
+        return False
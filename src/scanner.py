@@ -1,46 +1,271 @@
+import queue
 import cv2
-import pandas as pd
+from PIL import Image, ImageTk
 import tkinter as tk
 
+from catalog import load_catalog
 from detector import Detector
+from pipeline import MotionGate, Pipeline
+from timing import StageTimer
+from tracker import Tracker
 import utils
 
+def show_image(image, container):
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    img_pil = Image.fromarray(image)
+    img_tk = ImageTk.PhotoImage(img_pil)
+
+    label = tk.Label(container, image=img_tk, bg="black")
+    label.image = img_tk
+    label.pack(expand=True)
+
+def show_video(image, video_label):
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    img_pil = Image.fromarray(image)
+    img_tk = ImageTk.PhotoImage(image=img_pil)
+
+    video_label.imgtk = img_tk
+    video_label.config(image=img_tk)
+
 class Scanner():
 
-    def __init__(self, path_weights, size, confidence, iou, hash_size, path_df, save, path):
+    # size is only the detector's input size; cards are cropped from the
+    # full-resolution frame and overlays are drawn at display_size
+    display_size = 640
+    # Set tile_size (in original pixels) to detect large photos tile by tile
+    tile_size = None
+    tile_overlap = 0.25
+    # Stage timings are always collected; show_stats draws FPS and p50/p95
+    # per stage on the output, and report_path receives a JSON summary
+    show_stats = False
+    report_path = None
+
+    def __init__(self, path_weights, size, confidence, iou, hash_size, path_df, save, path, show_stats=None, report_path=None):
         self.detector = Detector(path_weights)
         self.size = size
         self.confidence = confidence
         self.iou = iou
         self.hash_size = hash_size
-        self.df = pd.read_excel(path_df).dropna(subset=['hash'])
-        self.df = self.df[self.df['Set_ID'].str.startswith('sv')]
+        self.df, self.index = load_catalog(path_df)
+        # Catalogs with rotated hashes already cover upside-down cards
+        self.hash_flipped = len(self.index) == len(self.df)
         self.save = save
         self.path_saved = path
+        if show_stats is not None:
+            self.show_stats = show_stats
+        if report_path is not None:
+            self.report_path = report_path
+        self.timer = StageTimer()
+
+    def identify(self, img):
+        with self.timer.stage('detect'):
+            detections = utils.detect_cards(img, self.detector, self.size, self.confidence, self.iou,
+                                            self.tile_size, self.tile_overlap)
+        self.identify_detections(img, detections)
+        return detections
+
+    def detect_batch(self, imgs):
+        with self.timer.stage('detect', len(imgs)):
+            results = self.detector.detect_batch(imgs, self.confidence, self.iou, self.size)
+        with self.timer.stage('process', len(imgs)):
+            return [utils.process_detections(result) for result in results]
+
+    def identify_detections(self, img, detections):
+        with self.timer.stage('rectify'):
+            utils.mask_to_card(img, detections)
+        with self.timer.stage('hash'):
+            utils.hash_cards(detections, self.hash_size, self.hash_flipped)
+        with self.timer.stage('match'):
+            utils.match_hashes(detections, self.df, self.index)
+
+    def draw_stats(self, image):
+        if self.show_stats:
+            self.timer.draw(image)
+
+    def write_report(self):
+        if self.report_path is not None:
+            self.timer.report(self.report_path)
+            print(f"Stage timings written to {self.report_path}")
 
 class ImageScanner(Scanner):
 
     def run(self, path_image, container):
         container.master.geometry(f"680x680")
 
-        img_original = utils.read_image(path_image, self.size)
-        img_original_copy = img_original.copy()
+        with self.timer.stage('read'):
+            img_original = utils.read_image(path_image)
         
-        detections = self.detector.detect_objects(img_original, self.confidence, self.iou)
-        detections = utils.process_detections(detections)
+        detections = self.identify(img_original)
+
+        with self.timer.stage('draw'):
+            img_original_copy, scale = utils.fit_image(img_original, self.display_size)
+            utils.draw(img_original_copy, detections, scale)
+        self.draw_stats(img_original_copy)
+
+        if self.save:
+            with self.timer.stage('write'):
+                cv2.imwrite(self.path_saved, img_original_copy)
+
+        with self.timer.stage('show'):
+            show_image(img_original_copy, container)
+        self.write_report()
+
+class StreamScanner(Scanner):
+
+    drop_oldest = False
+    batch_size = 1
+    # Tracks identified below confident_distance reuse their card until
+    # reverify_every frames pass or their box drifts under reverify_iou
+    reverify_every = 30
+    reverify_iou = 0.7
+    confident_distance = 128
+    # Association is independent of the detector's NMS iou, so fast moving
+    # cards stay on their track and brief misses do not drop it
+    track_iou = 0.3
+    max_missed = 5
+    # With keyframe_every > 1 the detector runs only every k frames, or when
+    # optical flow loses a track; the frames between move tracks by flow alone
+    keyframe_every = 1
+    # Mean absolute gray-level change (on a 64x64 copy) below which a frame
+    # is static and reuses the previous overlay; None disables the gate
+    motion_threshold = None
+
+    def __init__(self, *args, queue_size=2, drop_oldest=None, batch_size=None, reverify_every=None, keyframe_every=None,
+                 motion_threshold=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue_size = queue_size
+        if drop_oldest is not None:
+            self.drop_oldest = drop_oldest
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if reverify_every is not None:
+            self.reverify_every = reverify_every
+        if keyframe_every is not None:
+            self.keyframe_every = keyframe_every
+        if motion_threshold is not None:
+            self.motion_threshold = motion_threshold
+
+    def start_stream(self, container, fps):
+        self.video_label = tk.Label(container)
+        self.video_label.pack(expand=True)
+
+        self.tracker = Tracker(self.track_iou, self.max_missed, self.reverify_every,
+                               self.reverify_iou, self.confident_distance)
+        self.previous_gray = None
+        self.since_keyframe = 0
+        self.finished = False
+        self.motion_gate = MotionGate(self.motion_threshold) if self.motion_threshold is not None else None
+
+        if self.save:
+            self.writer = cv2.VideoWriter(self.path_saved,
+                                          cv2.VideoWriter_fourcc(*'MJPG'),
+                                          fps,
+                                          self.video_size)
 
-        utils.mask_to_card(img_original, detections)
-        utils.hash_cards(detections, self.hash_size)
-        utils.match_hashes(detections, self.df)
+        self.pipeline = Pipeline(self.timed_read_frame, self.process_frames, self.queue_size, self.drop_oldest, self.batch_size)
+        # Closing the window ends the stream without an end marker, so clean up here too
+        self.video_label.bind('<Destroy>', lambda event: self.close())
+        self.pipeline.start()
+        self.update_frame()
+
+    def close(self):
+        self.pipeline.stop()
+        self.pipeline.join()
+        self.finish()
+
+    def draw_stats(self, image):
+        if self.show_stats:
+            extra = [] if self.motion_gate is None else [f"gate {self.motion_gate.gated} skipped / {self.motion_gate.processed} processed"]
+            self.timer.draw(image, extra)
+
+    def timed_read_frame(self):
+        with self.timer.stage('read'):
+            return self.read_frame()
+
+    def process_frames(self, imgs):
+        with self.timer.stage('gate', len(imgs)):
+            static = [self.motion_gate is not None and self.motion_gate.static(img) for img in imgs]
+        moving = [img for img, still in zip(imgs, static) if not still]
+        batch = iter(self.detect_batch(moving) if moving and self.keyframe_every == 1 else [])
+
+        results = []
+        for img, still in zip(imgs, static):
+            if still:
+                results.append(self.render(img))
+            elif self.keyframe_every > 1:
+                results.append(self.process_keyframes(img))
+            else:
+                results.append(self.track_detections(img, next(batch)))
+        return results
+
+    def process_keyframes(self, img_original):
+        with self.timer.stage('flow'):
+            gray = cv2.cvtColor(img_original, cv2.COLOR_BGR2GRAY)
+            keyframe = (self.previous_gray is None
+                        or self.since_keyframe + 1 >= self.keyframe_every
+                        or not self.tracker.propagate(self.previous_gray, gray))
+            self.previous_gray = gray
+        if keyframe:
+            self.since_keyframe = 0
+            return self.track_detections(img_original, self.detect_batch([img_original])[0])
+        self.since_keyframe += 1
+        self.tracker.advance()
+        return self.render(img_original)
+
+    def track_detections(self, img_original, detections):
+        with self.timer.stage('assign'):
+            assignment = self.tracker.assign(detections)
+            pending = self.tracker.reuse_identities(detections, assignment)
+        self.identify_detections(img_original, pending)
+        with self.timer.stage('track'):
+            self.tracker.update(detections, assignment)
+        return self.render(img_original)
+
+    def render(self, img_original):
+        with self.timer.stage('draw'):
+            img_original_copy, scale = utils.fit_image(img_original, self.display_size)
+            utils.draw_t(img_original_copy, self.tracker, scale)
+        self.draw_stats(img_original_copy)
+
+        if self.save:
+            with self.timer.stage('write'):
+                self.writer.write(cv2.resize(img_original_copy, self.video_size))
+        return img_original_copy
+
+    def update_frame(self):
+        if self.finished:
+            return
+        try:
+            img = self.pipeline.results.get_nowait()
+        except queue.Empty:
+            self.video_label.after(5, self.update_frame)
+            return
 
-        utils.draw(img_original_copy, detections)
+        if img is None:
+            self.finish()
+            return
+
+        with self.timer.stage('show'):
+            show_video(img, self.video_label)
+        self.timer.tick()
+        self.video_label.after(1, self.update_frame)
 
+    def finish(self):
+        # Reached at the end of the stream or when the window closes, whichever comes first
+        if self.finished:
+            return
+        self.finished = True
         if self.save:
-            cv2.imwrite(self.path_saved, img_original_copy)
+            self.writer.release()
+        if self.motion_gate is not None:
+            print(f"Motion gate: {self.motion_gate.gated} static frames skipped, {self.motion_gate.processed} processed")
+        self.write_report()
 
-        utils.show_image(img_original_copy, container)
+class VideoScanner(StreamScanner):
 
-class VideoScanner(Scanner):
+    # Recorded videos are decoded ahead and sent through the model together
+    batch_size = 4
+    report_path = "timings.json"
 
     def run(self, path_video, container):
         container.master.geometry(f"680x680")
@@ -61,47 +286,25 @@ class VideoScanner(Scanner):
             print(f"Could not open the video: {path_video}")
             return
 
-        self.video_label = tk.Label(container)
-        self.video_label.pack(expand=True)
-
-        self.tracker = {'last_id':0,
-                        'matches':{}}
-        
-        if self.save:
-            self.writer = cv2.VideoWriter(self.path_saved,
-                                          cv2.VideoWriter_fourcc(*'MJPG'),
-                                          self.video.get(cv2.CAP_PROP_FPS),
-                                          self.video_size)
-
-        self.update_frame()
+        self.start_stream(container, self.video.get(cv2.CAP_PROP_FPS))
 
-    def update_frame(self):
+    def read_frame(self):
         ret, img_original = self.video.read()
         if not ret:
             print("End of video.")
-            if self.save:
-                self.writer.release()
-            return
-
-        img_original = cv2.resize(img_original, (self.size, self.size))
-        img_original_copy = img_original.copy()
+            return None
+        return img_original
 
-        detections = self.detector.detect_objects(img_original, self.confidence, self.iou)
-        detections = utils.process_detections(detections)
-        utils.mask_to_card(img_original, detections)
-        utils.hash_cards(detections, self.hash_size)
-        utils.match_hashes(detections, self.df)
-        utils.track_objects(detections, self.tracker, self.iou)
-        utils.draw_t(img_original_copy, self.tracker)
+    def finish(self):
+        if not self.finished:
+            super().finish()
+            self.video.release()
 
-        utils.show_video(img_original_copy, self.video_label)
+class LiveScanner(StreamScanner):
 
-        if self.save:
-            self.writer.write(cv2.resize(img_original_copy, self.video_size))
-
-        self.video_label.after(10, self.update_frame)
-
-class LiveScanner(Scanner):
+    drop_oldest = True
+    keyframe_every = 5
+    motion_threshold = 3.0
 
     def run(self, camera_id, container):
         container.master.geometry(f"680x680")
@@ -112,51 +315,20 @@ class LiveScanner(Scanner):
         fps = float(self.camera.get(cv2.CAP_PROP_FPS))
         print("Webcam started with resolution:", width, "x", height, 'fps:', fps)
 
-        self.video_size = (width, height)
-
-        r = self.video.get(cv2.CAP_PROP_ORIENTATION_META)
+        r = self.camera.get(cv2.CAP_PROP_ORIENTATION_META)
         if r == 90.0 or r == 270.0:
             self.video_size = (height, width)
         else:
             self.video_size = (width, height)
 
-        self.video.set(cv2.CAP_PROP_ORIENTATION_AUTO, 1.0)
-
-        self.video_label = tk.Label(container)
-        self.video_label.pack(expand=True)
+        self.camera.set(cv2.CAP_PROP_ORIENTATION_AUTO, 1.0)
 
-        self.tracker = {'last_id':0,
-                        'matches':{}}
-        
-        if self.save:
-            self.writer = cv2.VideoWriter(self.path_saved,
-                                          cv2.VideoWriter_fourcc(*'MJPG'),
-                                          fps,
-                                          self.video_size)
+        self.start_stream(container, fps)
 
-        self.update_frame()
+    def read_frame(self):
+        return utils.read_frame(self.camera)
 
-    def update_frame(self):
-        img_original = utils.read_frame(self.camera, self.size)
-        if img_original is None:
+    def finish(self):
+        if not self.finished:
+            super().finish()
             self.camera.release()
-            if self.save:
-                self.writer.release()
-            return
-
-        img_original_copy = img_original.copy()
-
-        detections = self.detector.detect_objects(img_original, self.confidence, self.iou)
-        detections = utils.process_detections(detections)
-        utils.mask_to_card(img_original, detections)
-        utils.hash_cards(detections, self.hash_size)
-        utils.match_hashes(detections, self.df)
-        utils.track_objects(detections, self.tracker, self.iou)
-        utils.draw_t(img_original_copy, self.tracker)
-
-        utils.show_video(img_original_copy, self.video_label)
-
-        if self.save:
-            self.writer.write(cv2.resize(img_original_copy, self.video_size))
-
-        self.video_label.after(10, self.update_frame)
\ No newline at end of file
@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+
+def tile_origins(shape, tile_size, overlap):
+    # Top-left corners of tile_size tiles overlapping by a fraction of a tile.
+    # The last tile in each axis is pushed back so it ends on the image border.
+    height, width = shape[:2]
+    step = max(int(tile_size * (1 - overlap)), 1)
+    def axis(length):
+        if length <= tile_size:
+            return [0]
+        starts = list(range(0, length - tile_size, step))
+        return starts + [length - tile_size]
+    return [(x, y) for y in axis(height) for x in axis(width)]
+
+def offset_detections(detections, origin, tile_shape, image_shape, margin=2):
+    x, y = origin
+    height, width = tile_shape[:2]
+    for det in detections:
+        segmentation = np.asarray(det['segmentation'], dtype=np.float32)
+        # A polygon reaching a tile edge that is not also an image edge is only
+        # the part of a card this tile could see
+        low, high = segmentation.min(axis=0), segmentation.max(axis=0)
+        det['cut'] = bool((x > 0 and low[0] <= margin) or (y > 0 and low[1] <= margin) or
+                          (x + width < image_shape[1] and high[0] >= width - margin) or
+                          (y + height < image_shape[0] and high[1] >= height - margin))
+        det['bbox'] = det['bbox'] + np.array([x, y, 0, 0])
+        det['segmentation'] = segmentation + np.array([x, y], dtype=np.float32)
+        # The dense mask still belongs to the tile; mask_to_card maps it back with these
+        det['tile_origin'] = origin
+        det['tile_shape'] = tile_shape
+    return detections
+
+def merge_detection(det, hull):
+    # The merged card spans several tiles, so no single tile mask describes it
+    x, y, w, h = cv2.boundingRect(hull)
+    merged = {k: v for k, v in det.items() if k not in ('mask', 'tile_origin', 'tile_shape')}
+    merged['bbox'] = np.array([x + w // 2, y + h // 2, w, h])
+    merged['segmentation'] = hull.reshape(-1, 2)
+    return merged
+
+def polygon_nms(detections, threshold=0.5, merge_threshold=0.1):
+    # Cards cut by a tile border show up as fragments in several tiles, and
+    # whole in the full frame when it is big enough there. Larger polygons are
+    # kept first. A fragment overlapping a kept polygon (intersection over its
+    # own area above merge_threshold) is merged into it as the convex hull of
+    # both, so a card wider than the overlap is still rebuilt whole. Any other
+    # polygon that mostly lies inside a kept one is dropped.
+    if len(detections) < 2:
+        return detections
+    hulls = [cv2.convexHull(np.asarray(det['segmentation'], dtype=np.float32).reshape(-1, 1, 2)) for det in detections]
+    areas = np.array([cv2.contourArea(hull) for hull in hulls])
+    boxes = np.array([cv2.boundingRect(hull) for hull in hulls], dtype=np.float64)
+    low, high = boxes[:, :2], boxes[:, :2] + boxes[:, 2:]
+    cut = [det.get('cut', False) for det in detections]
+
+    kept, merged = [], set()
+    for i in np.argsort(-areas, kind='stable'):
+        duplicate = False
+        for j in kept:
+            # Box overlap is a cheap prefilter, only touching pairs get the polygon test
+            if not np.all(np.minimum(high[i], high[j]) > np.maximum(low[i], low[j])):
+                continue
+            inter, _ = cv2.intersectConvexConvex(hulls[i], hulls[j])
+            if areas[i] == 0:
+                duplicate = True
+            elif (cut[i] or cut[j]) and inter / areas[i] >= merge_threshold:
+                hulls[j] = cv2.convexHull(np.concatenate([hulls[j], hulls[i]]))
+                low[j], high[j] = hulls[j].min(axis=(0, 1)), hulls[j].max(axis=(0, 1))
+                cut[j] = cut[j] and cut[i]
+                merged.add(j)
+                duplicate = True
+            elif inter / areas[i] >= threshold:
+                duplicate = True
+            if duplicate:
+                break
+        if not duplicate:
+            kept.append(i)
+    return [merge_detection(detections[i], hulls[i]) if i in merged else detections[i] for i in sorted(kept)]
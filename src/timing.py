@@ -0,0 +1,74 @@
+import json
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+class Stage():
+
+    __slots__ = ('timer', 'name', 'frames', 'start')
+
+    def __init__(self, timer, name, frames):
+        self.timer = timer
+        self.name = name
+        self.frames = frames
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        # Batched stages are stored per frame so every stage shares one unit
+        self.timer.add(self.name, (time.perf_counter_ns() - self.start) / self.frames)
+
+class StageTimer():
+
+    # Per-stage latencies cheap enough to leave on: one perf_counter_ns pair
+    # and a deque append per stage. The last `window` samples give rolling
+    # percentiles, the totals cover the whole run. Each stage is only ever
+    # timed from one thread, so no lock is needed.
+    def __init__(self, window=300):
+        self.window = window
+        self.samples = {}
+        self.totals = {}
+        self.frames = deque(maxlen=window)
+
+    def stage(self, name, frames=1):
+        return Stage(self, name, max(frames, 1))
+
+    def add(self, name, ns):
+        if name not in self.samples:
+            self.samples[name] = deque(maxlen=self.window)
+            self.totals[name] = [0, 0]
+        self.samples[name].append(ns)
+        total = self.totals[name]
+        total[0] += 1
+        total[1] += ns
+
+    def tick(self):
+        self.frames.append(time.perf_counter_ns())
+
+    def fps(self):
+        if len(self.frames) < 2:
+            return 0.0
+        return (len(self.frames) - 1) * 1e9 / (self.frames[-1] - self.frames[0])
+
+    def stats(self):
+        stats = {}
+        for name, samples in list(self.samples.items()):
+            ms = np.array(samples) / 1e6
+            count, total = self.totals[name]
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            stats[name] = {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                           'mean_ms': total / count / 1e6, 'count': count}
+        return stats
+
+    def draw(self, image, extra=()):
+        lines = [f"FPS {self.fps():.1f}"] + [f"{name} {s['p50_ms']:.1f} / {s['p95_ms']:.1f} ms"
+                                             for name, s in self.stats().items()] + list(extra)
+        for i, line in enumerate(lines):
+            cv2.putText(image, line, (8, 16 + 14 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 255), 1, cv2.LINE_AA)
+
+    def report(self, path):
+        with open(path, 'w') as file:
+            json.dump({'fps': self.fps(), 'window': self.window, 'stages': self.stats()}, file, indent=2)
@@ -0,0 +1,167 @@
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+def box_iou(boxes1, boxes2):
+    # Center-format (x, y, w, h) boxes, broadcast over the leading axes
+    boxes1 = np.asarray(boxes1, dtype=np.float64)
+    boxes2 = np.asarray(boxes2, dtype=np.float64)
+    half1, half2 = boxes1[..., 2:] / 2, boxes2[..., 2:] / 2
+    low = np.maximum(boxes1[..., :2] - half1, boxes2[..., :2] - half2)
+    high = np.minimum(boxes1[..., :2] + half1, boxes2[..., :2] + half2)
+    inter = np.prod(np.clip(high - low, 0, None), axis=-1)
+    union = np.prod(boxes1[..., 2:], axis=-1) + np.prod(boxes2[..., 2:], axis=-1) - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+def detection_boxes(detections):
+    return np.array([det['bbox'] for det in detections], dtype=np.int64).reshape(-1, 4)
+
+class Tracker():
+
+    # One row per track. Ragged fields (polygons, labels) live in object
+    # arrays so every column is filtered with the same index.
+    def __init__(self, iou_threshold=0.3, max_missed=5, reverify_every=30, reverify_iou=0.7, confident_distance=128):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.reverify_every = reverify_every
+        self.reverify_iou = reverify_iou
+        self.confident_distance = confident_distance
+        self.frame = 0
+        self.last_id = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.int64)
+        self.missed = np.empty(0, dtype=np.int64)
+        self.verified_boxes = np.empty((0, 4), dtype=np.int64)
+        self.verified_frames = np.empty(0, dtype=np.int64)
+        # NaN distance means the track has no identity
+        self.distances = np.empty(0, dtype=np.float64)
+        self.labels = np.empty(0, dtype=object)
+        self.segmentations = np.empty(0, dtype=object)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def assign(self, detections):
+        # Track row per detection, -1 for detections that start a new track
+        assignment = np.full(len(detections), -1, dtype=np.int64)
+        if len(detections) and len(self):
+            iou = box_iou(detection_boxes(detections)[:, None], self.boxes[None])
+            rows, cols = linear_sum_assignment(iou, maximize=True)
+            keep = iou[rows, cols] >= self.iou_threshold
+            assignment[rows[keep]] = cols[keep]
+        for det, track in zip(detections, assignment):
+            if track >= 0:
+                det['track_id'] = int(self.ids[track])
+        return assignment
+
+    def reuse_identities(self, detections, assignment):
+        # Confident tracks keep their card until reverify_every frames pass
+        # or the box drifts below reverify_iou from where it was verified
+        tracked = np.flatnonzero(assignment >= 0)
+        tracks = assignment[tracked]
+        reuse = ((self.distances[tracks] < self.confident_distance)
+                 & (self.frame - self.verified_frames[tracks] < self.reverify_every)
+                 & (box_iou(detection_boxes(detections)[tracked], self.verified_boxes[tracks]) >= self.reverify_iou))
+        for i, track in zip(tracked[reuse], tracks[reuse]):
+            detections[i]['match_card'] = self.labels[track]
+            detections[i]['match_distance'] = self.distances[track]
+            detections[i]['cached'] = True
+        return [det for det in detections if not det.get('cached')]
+
+    def update(self, detections, assignment):
+        boxes = detection_boxes(detections)
+        matched = assignment >= 0
+        tracks = assignment[matched]
+        self.boxes[tracks] = boxes[matched]
+        self.missed += 1
+        self.missed[tracks] = 0
+        for det, track in zip(detections, assignment):
+            if track >= 0:
+                self.segmentations[track] = det['segmentation']
+
+        new = np.flatnonzero(~matched)
+        self.ids = np.concatenate([self.ids, np.arange(self.last_id, self.last_id + len(new))])
+        self.last_id += len(new)
+        self.boxes = np.concatenate([self.boxes, boxes[new]])
+        self.missed = np.concatenate([self.missed, np.zeros(len(new), dtype=np.int64)])
+        self.verified_boxes = np.concatenate([self.verified_boxes, boxes[new]])
+        self.verified_frames = np.concatenate([self.verified_frames, np.full(len(new), self.frame)])
+        self.distances = np.concatenate([self.distances, np.full(len(new), np.nan)])
+        self.labels = np.concatenate([self.labels, np.full(len(new), None, dtype=object)])
+        segmentations = np.empty(len(new), dtype=object)
+        segmentations[:] = [detections[i]['segmentation'] for i in new]
+        self.segmentations = np.concatenate([self.segmentations, segmentations])
+        assignment = assignment.copy()
+        assignment[new] = len(self) - len(new) + np.arange(len(new))
+
+        # Only a fresh hash can confirm or drop the identity a track carries
+        for det, track in zip(detections, assignment):
+            if 'hash' in det and not det.get('cached'):
+                self.verified_frames[track] = self.frame
+                self.verified_boxes[track] = det['bbox']
+                self.labels[track] = det.get('match_card')
+                self.distances[track] = det.get('match_distance', np.nan)
+            det['track_id'] = int(self.ids[track])
+
+        self.keep(self.missed <= self.max_missed)
+        self.frame += 1
+
+    def propagate(self, prev_gray, gray, max_corners=40, min_points=8, min_inliers=0.6):
+        # Moves every visible track with sparse Lucas-Kanade flow and a per-track
+        # homography. Returns False when any track cannot be followed reliably.
+        rows = np.flatnonzero(self.missed == 0)
+        points, owners = [], []
+        for row in rows:
+            # Features are searched only inside the track's bounding rectangle
+            polygon = np.asarray(self.segmentations[row]).reshape(-1, 2).astype(np.int32)
+            x, y, w, h = cv2.boundingRect(polygon)
+            x, y = max(x, 0), max(y, 0)
+            roi = prev_gray[y:y + h, x:x + w]
+            if roi.size == 0:
+                return False
+            mask = np.zeros(roi.shape, dtype=np.uint8)
+            cv2.fillPoly(mask, [polygon - (x, y)], 255)
+            corners = cv2.goodFeaturesToTrack(roi, max_corners, 0.01, 5, mask=mask)
+            if corners is None or len(corners) < min_points:
+                return False
+            points.append(corners + np.array([x, y], dtype=np.float32))
+            owners.append(np.full(len(corners), row))
+        if not points:
+            return True
+
+        points = np.concatenate(points).astype(np.float32)
+        owners = np.concatenate(owners)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, winSize=(21, 21), maxLevel=3)
+        status = status.ravel() == 1
+
+        homographies = {}
+        for row in rows:
+            ok = status & (owners == row)
+            if ok.sum() < min_points:
+                return False
+            H, inliers = cv2.findHomography(points[ok], moved[ok], cv2.RANSAC, 3.0)
+            if H is None or inliers.mean() < min_inliers:
+                return False
+            homographies[row] = H
+
+        # Only commit once every track has moved, so a failed frame leaves the tracker untouched
+        for row, H in homographies.items():
+            polygon = np.asarray(self.segmentations[row], dtype=np.float32).reshape(-1, 1, 2)
+            polygon = cv2.perspectiveTransform(polygon, H).reshape(-1, 2)
+            x, y, w, h = cv2.boundingRect(polygon)
+            self.segmentations[row] = polygon
+            self.boxes[row] = (x + w // 2, y + h // 2, w, h)
+        return True
+
+    def advance(self):
+        # Frames served by propagate still count towards re-verification
+        self.frame += 1
+
+    def keep(self, rows):
+        for name in ('ids', 'boxes', 'missed', 'verified_boxes', 'verified_frames', 'distances', 'labels', 'segmentations'):
+            setattr(self, name, getattr(self, name)[rows])
+
+    def visible(self):
+        # Tracks coasting through missed frames keep their identity but are not drawn
+        rows = np.flatnonzero(self.missed == 0)
+        return zip(self.boxes[rows], self.segmentations[rows], self.labels[rows])
@@ -1,87 +1,200 @@
 import cv2
 import numpy as np
-import imagehash
-from PIL import Image, ImageTk
 import pandas as pd
-import tkinter as tk
 
-def read_frame(camera, size):
+import hashing
+import tiling
+
+CARD_SIZE = (600, 825)
+# Same 8:11 aspect as CARD_SIZE and above the 64x64 the pHash resize needs
+THUMB_SIZE = (128, 176)
+
+def read_frame(camera):
     ret, frame = camera.read()
 
     if not ret:
         print("Failed to read frame from the webcam")
         return None
 
-    resized_frame = cv2.resize(frame, (size, size))
-    return resized_frame
+    return frame
+
+def read_image(path_image):
+    return cv2.imread(path_image)
 
-def read_image(path_image, size):
-    img = cv2.imread(path_image)
-    img = cv2.resize(img, (size, size))
-    return img
+def fit_image(image, size):
+    # Downscales for display so the longest side is size, keeping the aspect ratio
+    scale = size / max(image.shape[:2])
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
 
 def process_detections(detections):
     if detections.masks is None:
         return []
+    # Boxes and polygons come back in full-resolution image coordinates.
+    # Masks stay on the model's device; only the mask_to_card fallback reads them
     return [
         {
             'bbox': bbox.cpu().numpy().astype(int),
             'segmentation': seg,
-            'mask': mask.cpu().numpy()
+            'mask': mask
         }
         for mask, seg, bbox in zip(detections.masks.data, detections.masks.xy, detections.boxes.xywh)
     ]
 
-def mask_to_card(image, detections):
-    for det in detections:
-        mask = (det['mask'].astype(np.uint8)) * 255
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        for contour in contours:
-            epsilon = 0.1 * cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, epsilon, True)
-            if len(approx) == 4:
-                center = np.mean(approx, axis=0)
-                corners = np.array(sorted(approx, key=lambda x: np.arctan2(x[0][1] - center[0][1], x[0][0] - center[0][0])))
-                width = np.linalg.norm(corners[0] - corners[1])
-                height = np.linalg.norm(corners[1] - corners[2])
-                dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
-                M = cv2.getPerspectiveTransform(corners.astype(np.float32), dst)
-                card = cv2.warpPerspective(image, M, (int(width), int(height)))
-                if width > height:
-                    card = cv2.rotate(card, cv2.ROTATE_90_CLOCKWISE)
-                det['card_image'] = cv2.resize(card, (600, 825))
-                break
-
-def hash_image(img, hash_size):
-    pil_img = Image.fromarray(img).convert('RGB')
-    return f'{imagehash.dhash(pil_img, hash_size)}{imagehash.phash(pil_img, hash_size)}'
-
-def hash_cards(detections, hash_size):
-    for det in detections:
-        if 'card_image' in det:
-            det['hash'] = hash_image(det['card_image'], hash_size)
-            flipped = cv2.rotate(det['card_image'], cv2.ROTATE_180)
-            det['hash_flipped'] = hash_image(flipped, hash_size)
-
-def hamming_distance(h1, h2):
-    return sum(a != b for a, b in zip(h1, h2))
-
-def find_match(h, df, threshold=15*6.8):  #14*6.8
-    df['similarity'] = df['hash'].apply(lambda x: hamming_distance(x, h))
-    min_row = df.loc[df['similarity'].idxmin()]
-    if min_row['similarity'] < threshold:
-        return f"{min_row['Name']}\n{min_row['Set_Name']}\n{min_row['Local_ID']}", min_row['similarity']
-    return None, None
-
-def match_hashes(detections, df):
+def approx_quad(contour):
+    contour = contour.reshape(-1, 1, 2)
+    epsilon = 0.1 * cv2.arcLength(contour, True)
+    approx = cv2.approxPolyDP(contour, epsilon, True)
+    return approx.reshape(4, 2) if len(approx) == 4 else None
+
+def mask_quad(mask, shape):
+    mask = (np.asarray(mask.cpu().numpy() if hasattr(mask, 'cpu') else mask).astype(np.uint8)) * 255
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in contours:
+        quad = approx_quad(contour)
+        if quad is not None:
+            # Masks are at the letterboxed detection size, undo it to reach image coordinates
+            gain = min(mask.shape[0] / shape[0], mask.shape[1] / shape[1])
+            pad = np.array([mask.shape[1] - shape[1] * gain, mask.shape[0] - shape[0] * gain]) / 2
+            return ((quad - pad) / gain).astype(np.float32)
+    return None
+
+def order_corners(quads):
+    # (N, 4, 2) quads sorted by angle around their center, for all cards at once
+    center = quads.mean(axis=1, keepdims=True)
+    angles = np.arctan2(quads[..., 1] - center[..., 1], quads[..., 0] - center[..., 0])
+    return np.take_along_axis(quads, np.argsort(angles, axis=1)[..., None], axis=1)
+
+def warp_card(image, corners, width, height, size):
+    # Rotation to portrait and the scaling are folded into one perspective warp.
+    # Bilinear sampling aliases when it shrinks a lot, so a card more than twice
+    # the output size is warped to twice the size and then area-averaged down.
+    if width > height:
+        dst = np.array([[height - 1, 0], [height - 1, width - 1], [0, width - 1], [0, 0]], dtype=np.float32)
+        width, height = height, width
+    else:
+        dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    factor = 2 if width > 2 * size[0] else 1
+    canvas = (size[0] * factor, size[1] * factor)
+    dst = (dst + 0.5) * np.array([canvas[0] / width, canvas[1] / height], dtype=np.float32) - 0.5
+    M = cv2.getPerspectiveTransform(corners, dst)
+    card = cv2.warpPerspective(image, M, canvas)
+    return card if factor == 1 else cv2.resize(card, size, interpolation=cv2.INTER_AREA)
+
+def mask_to_card(image, detections, crops=False):
+    cards, quads = [], []
     for det in detections:
-        if 'hash' in det:
-            match1, sim1 = find_match(det['hash'], df)
-            match2, sim2 = find_match(det['hash_flipped'], df)
-            if match1 and (not match2 or sim1 <= sim2):
-                det['match_card'] = match1
-            elif match2:
-                det['match_card'] = match2
+        # The model's polygon is enough for almost every card; contouring the
+        # dense mask is only needed when it does not simplify to four corners
+        quad = None
+        if len(det['segmentation']) >= 4:
+            quad = approx_quad(np.asarray(det['segmentation'], dtype=np.float32))
+        if quad is None and 'mask' in det:
+            quad = mask_quad(det['mask'], det.get('tile_shape', image.shape))
+            if quad is not None and 'tile_origin' in det:
+                quad = quad + np.array(det['tile_origin'], dtype=np.float32)
+        if quad is not None:
+            cards.append(det)
+            quads.append(quad)
+    if not cards:
+        return
+
+    corners = order_corners(np.array(quads, dtype=np.float32))
+    widths = np.linalg.norm(corners[:, 0] - corners[:, 1], axis=1)
+    heights = np.linalg.norm(corners[:, 1] - corners[:, 2], axis=1)
+    for det, quad, width, height in zip(cards, corners, widths, heights):
+        # Hashing only needs a thumbnail; the full crop is made only when asked for
+        det['card_thumb'] = warp_card(image, quad, width, height, THUMB_SIZE)
+        if crops:
+            det['card_image'] = warp_card(image, quad, width, height, CARD_SIZE)
+
+def hash_cards(detections, hash_size, flipped=True):
+    cards = [det for det in detections if 'card_thumb' in det]
+    # Frames are BGR but the catalog was hashed from RGB images
+    crops = [cv2.cvtColor(det['card_thumb'], cv2.COLOR_BGR2RGB) for det in cards]
+    if flipped:
+        crops += [cv2.rotate(crop, cv2.ROTATE_180) for crop in crops]
+    hashes = hashing.hash_images(crops, hash_size)
+    for i, det in enumerate(cards):
+        det['hash'] = hashes[i]
+        if flipped:
+            det['hash_flipped'] = hashes[len(cards) + i]
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def hash_to_bits(h):
+    return np.frombuffer(bytes.fromhex(h), dtype=np.uint8)
+
+def pack_hashes(bits):
+    bits = np.atleast_2d(bits)
+    if bits.dtype == np.uint64:
+        return np.asfortranarray(bits)
+    bits = bits.astype(np.uint8, copy=False)
+    pad = -bits.shape[1] % 8
+    if pad:
+        bits = np.pad(bits, ((0, 0), (0, pad)))
+    # Column-major so each 64-bit word of the catalog is scanned contiguously
+    return np.asfortranarray(np.ascontiguousarray(bits).view(np.uint64))
+
+def hashes_to_matrix(hashes):
+    return pack_hashes([hash_to_bits(h) for h in hashes])
+
+def popcount(x):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    x = np.ascontiguousarray(x)
+    return POPCOUNT[x.view(np.uint8)].reshape(x.shape + (-1,)).sum(axis=-1, dtype=np.uint8)
+
+def hamming_distances(queries, matrix):
+    queries = pack_hashes(queries)
+    distances = np.zeros((len(queries), len(matrix)), dtype=np.int32)
+    for j in range(matrix.shape[1]):
+        distances += popcount(np.bitwise_xor.outer(queries[:, j], matrix[:, j]))
+    return distances
+
+def card_label(row):
+    return f"{row['Name']}\n{row['Set_Name']}\n{row['Local_ID']}"
+
+# Bit-level equivalent of the former 15*6.8 threshold on differing hex characters
+def find_matches(queries, index, threshold=168):
+    queries = np.asarray(queries)
+    ids, distances = index.search(queries.reshape(-1, queries.shape[-1]), 1, threshold)
+    ids, distances = ids.reshape(len(queries), -1), distances.reshape(len(queries), -1)
+    best = distances.argmin(axis=1)
+    rows = np.arange(len(queries))
+    return ids[rows, best], distances[rows, best]
+
+def match_hashes(detections, df, index, threshold=168):
+    hashed = [det for det in detections if 'hash' in det]
+    if not hashed:
+        return
+    queries = np.stack([[det['hash'], det['hash_flipped']] if 'hash_flipped' in det else [det['hash']] for det in hashed])
+    ids, distances = find_matches(queries, index, threshold)
+    for det, i, distance in zip(hashed, ids, distances):
+        if i >= 0:
+            det['match_card'] = card_label(df.iloc[i % len(df)])
+            det['match_id'] = int(i % len(df))
+            det['match_distance'] = int(distance)
+
+def detect_cards(image, detector, size, confidence, iou, tile_size=None, tile_overlap=0.25):
+    if tile_size is None:
+        return process_detections(detector.detect_objects(image, confidence, iou, size))
+
+    origins = tiling.tile_origins(image.shape, tile_size, tile_overlap)
+    tiles = [image[y:y + tile_size, x:x + tile_size] for x, y in origins]
+    # The whole frame rides in the same batch so cards larger than a tile are still found whole
+    results = detector.detect_batch([image] + tiles, confidence, iou, size)
+    detections = process_detections(results[0])
+    for origin, tile, result in zip(origins, tiles, results[1:]):
+        detections += tiling.offset_detections(process_detections(result), origin, tile.shape, image.shape)
+    return tiling.polygon_nms(detections)
+
+def identify_cards(image, detector, size, confidence, iou, hash_size, df, index, flipped=True, crops=False,
+                   tile_size=None, tile_overlap=0.25):
+    detections = detect_cards(image, detector, size, confidence, iou, tile_size, tile_overlap)
+    mask_to_card(image, detections, crops)
+    hash_cards(detections, hash_size, flipped)
+    match_hashes(detections, df, index)
+    return detections
 
 def draw_boxes_and_segmentation(image, x, y, w, h, segmentation, bbox=False):
     if bbox:
@@ -103,91 +216,18 @@ def draw_label(image, x, y, w, label):
         y0 = y + i*dy
         cv2.putText(image, line, (x, y0), font, fontScale, color, thickness, cv2.LINE_AA)
 
-def draw(image, detections):
+def draw(image, detections, scale=1.0):
     for detection in detections:
-        x, y, w, h = detection["bbox"]
-        segmentation = np.array(detection["segmentation"]).reshape(-1, 2).astype(np.int32)
+        x, y, w, h = (np.asarray(detection["bbox"]) * scale).astype(int)
+        segmentation = (np.array(detection["segmentation"]).reshape(-1, 2) * scale).astype(np.int32)
         draw_boxes_and_segmentation(image, x, y, w, h, segmentation)
         if 'match_card' in detection.keys():
             draw_label(image, x, y, w, detection["match_card"])
 
-def draw_t(image, tracker):
-    for id in tracker['matches']:
-        x, y, w, h = tracker['matches'][id]["bbox"]
-        segmentation = np.array(tracker['matches'][id]["segmentation"]).reshape(-1, 2).astype(np.int32)
+def draw_t(image, tracker, scale=1.0):
+    for bbox, segmentation, label in tracker.visible():
+        x, y, w, h = (np.asarray(bbox) * scale).astype(int)
+        segmentation = (np.array(segmentation).reshape(-1, 2) * scale).astype(np.int32)
         draw_boxes_and_segmentation(image, x, y, w, h, segmentation)
-        if 'match_card' in tracker['matches'][id].keys():
-            draw_label(image, x, y, w, tracker['matches'][id]["match_card"])
-
-def show_image(image, container):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    img_pil = Image.fromarray(image)
-    img_tk = ImageTk.PhotoImage(img_pil)
-
-    label = tk.Label(container, image=img_tk, bg="black")
-    label.image = img_tk
-    label.pack(expand=True)
-
-def show_video(image, video_label):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    img_pil = Image.fromarray(image)
-    img_tk = ImageTk.PhotoImage(image=img_pil)
-
-    video_label.imgtk = img_tk
-    video_label.config(image=img_tk)
-
-def calcular_iou(bbox1, bbox2):
-    x1_1, y1_1, x2_1, y2_1 = bbox1
-    x1_2, y1_2, x2_2, y2_2 = bbox2
-
-    xA = max(x1_1, x1_2)
-    yA = max(y1_1, y1_2)
-    xB = min(x2_1, x2_2)
-    yB = min(y2_1, y2_2)
-
-    inter_ancho = max(0, xB - xA)
-    inter_alto = max(0, yB - yA)
-    inter_area = inter_ancho * inter_alto
-
-    area1 = (x2_1 - x1_1) * (y2_1 - y1_1)
-    area2 = (x2_2 - x1_2) * (y2_2 - y1_2)
-
-    union_area = area1 + area2 - inter_area
-
-    if union_area == 0:
-        return 0.0
-
-    iou = inter_area / union_area
-    return iou
-
-def track_objects(detections, tracked_matches, threshold):
-    new_detections = []
-    new_matches = {}
-    for detection in detections:
-        x, y, w, h = detection["bbox"]
-        x1_2 = x - int(w/2)
-        y1_2 = y - int(h/2) 
-        x2_2 = x + int(w/2)
-        y2_2 = y + int(h/2)
-        for key in tracked_matches['matches']:
-            x, y, w, h = tracked_matches['matches'][key]["bbox"]
-            x1_1 = x - int(w/2) 
-            y1_1 = y - int(h/2) 
-            x2_1 = x + int(w/2)
-            y2_1 = y + int(h/2)
-            iou = calcular_iou([x1_1, y1_1, x2_1, y2_1], [x1_2, y1_2, x2_2, y2_2])
-            if iou > threshold:
-                new_matches[key] = tracked_matches['matches'][key]
-                detection['match'] = True
-        if 'match' not in detection.keys():
-            new_detections.append(detection)
-            id = str(tracked_matches['last_id'])
-            new_matches[id] = {}
-            new_matches[id]["bbox"] = detection["bbox"]
-            new_matches[id]["segmentation"] = detection["segmentation"]
-            if 'match_card' in detection.keys():
-                new_matches[id]["match_card"] = detection["match_card"]
-            tracked_matches['last_id'] += 1
-                
-    detections = new_detections
-    tracked_matches['matches'] = new_matches
\ No newline at end of file
+        if label is not None:
+            draw_label(image, x, y, w, label)
@@ -0,0 +1,62 @@
+import copy
+
+import cv2
+import numpy as np
+import pandas as pd
+
+import catalog
+import hashing
+import utils
+
+HASH_SIZE = 16
+
+def make_cards(n, rng):
+    cards = []
+    for _ in range(n):
+        card = cv2.resize(rng.integers(0, 256, (11, 8, 3), dtype=np.uint8), utils.THUMB_SIZE, interpolation=cv2.INTER_CUBIC)
+        for _ in range(8):
+            center = (int(rng.integers(0, utils.THUMB_SIZE[0])), int(rng.integers(0, utils.THUMB_SIZE[1])))
+            cv2.circle(card, center, int(rng.integers(4, 30)), [int(v) for v in rng.integers(0, 256, 3)], -1)
+        cards.append(card)
+    return cards
+
+def load_spreadsheet(monkeypatch, df):
+    # Goes through read_excel_catalog so the rotated rows are laid out the way the scanner loads them
+    monkeypatch.setattr(catalog.pd, 'read_excel', lambda path: df)
+    df, hashes = catalog.read_excel_catalog('cards_of_pokemon.xlsx')
+    return df, catalog.HashIndex(hashes)
+
+def test_single_hash_matches_two_hash_path(monkeypatch):
+    rng = np.random.default_rng(0)
+    cards = make_cards(200, rng)
+    # Hashed like add_hash_column: RGB card images and their 180 degree rotations
+    rgb = [cv2.cvtColor(card, cv2.COLOR_BGR2RGB) for card in cards]
+    hashes = hashing.hash_images(rgb, HASH_SIZE)
+    rotated = hashing.hash_images([img[::-1, ::-1] for img in rgb], HASH_SIZE)
+    sheet = pd.DataFrame({'Name': [f"card {i}" for i in range(len(cards))], 'Set_Name': 'test', 'Local_ID': np.arange(len(cards)),
+                          'hash': [hashing.bits_to_hex(h) for h in hashes]})
+    df_plain, plain = load_spreadsheet(monkeypatch, sheet)
+    df_rotated, with_rotated = load_spreadsheet(monkeypatch, sheet.assign(hash_rotated=[hashing.bits_to_hex(h) for h in rotated]))
+    assert len(with_rotated.hashes) == 2 * len(df_rotated)
+
+    # Blurred, noisy crops of known cards, half of them upside down
+    truth = rng.choice(len(cards), 60, replace=False)
+    detections = []
+    for n, i in enumerate(truth):
+        thumb = cv2.GaussianBlur(cards[i], (3, 3), 0)
+        thumb = np.clip(thumb + rng.normal(0, 4, thumb.shape), 0, 255).astype(np.uint8)
+        if n % 2:
+            thumb = cv2.rotate(thumb, cv2.ROTATE_180)
+        detections.append({'card_thumb': thumb})
+
+    two_hash = copy.deepcopy(detections)
+    utils.hash_cards(two_hash, HASH_SIZE, flipped=True)
+    utils.match_hashes(two_hash, df_plain, plain)
+
+    single_hash = copy.deepcopy(detections)
+    utils.hash_cards(single_hash, HASH_SIZE, flipped=False)
+    assert all('hash_flipped' not in det for det in single_hash)
+    utils.match_hashes(single_hash, df_rotated, with_rotated)
+
+    assert [det.get('match_id') for det in single_hash] == [det.get('match_id') for det in two_hash]
+    assert [det.get('match_id') for det in single_hash] == list(truth)